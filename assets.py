@@ -0,0 +1,487 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from catalog import catalog, asset_index
+
+# 猫meme在场景画面中的缩放比例
+MEME_SCALE = 0.35
+
+# 解码后素材缓存的默认内存上限（字节），可通过环境变量 MEME_CACHE_BYTES 调整
+DEFAULT_CACHE_BYTES = int(os.environ.get('MEME_CACHE_BYTES', 1024 * 1024 * 1024))
+# 背景图片缓存的内存上限（字节），默认可以容纳全部背景（1080宽约3.5MB一张）
+DEFAULT_BACKGROUND_CACHE_BYTES = int(os.environ.get('BACKGROUND_CACHE_BYTES', 256 * 1024 * 1024))
+# 帧图集中每个meme保存的最长时长（秒），更长的场景回退为现场解码
+ATLAS_SECONDS = float(os.environ.get('MEME_ATLAS_SECONDS', 6))
+# 设置为0时不使用帧图集
+ATLAS_ENABLED = os.environ.get('MEME_ATLAS', '1') != '0'
+
+
+def chroma_key_alpha(frames):
+    """
+    根据绿幕计算alpha通道：绿色区域为0，非绿色区域为255
+    与 movie.chroma_key_paste 的判定一致：g - (r+b)/2 > 50 视为绿幕
+    """
+    f = frames.astype(np.int16)
+    green = 2 * f[..., 1] - f[..., 0] - f[..., 2]
+    return np.where(green > 100, 0, 255).astype(np.uint8)
+
+
+class MemeAsset:
+    """
+    解码并缩放好的猫meme素材
+    frames: (N, h, w, 3) uint8，按渲染帧率采样的画面
+    alpha:  (N, h, w) uint8，预先计算好的绿幕alpha
+    duration 为 0 时只保存第一帧（静态meme）
+    来自帧图集时 frames/alpha 是内存映射文件上的视图：只保存不透明区域（size 为完整画面尺寸，
+    offset 为该区域在完整画面中的位置），rows 把第k个渲染帧映射到 frames 的行
+    """
+    def __init__(self, name, scale, duration, fps, frames, alpha, rows=None, size=None, offset=(0, 0)):
+        self.name = name
+        self.scale = scale
+        self.duration = duration
+        self.fps = fps
+        self.frames = frames
+        self.alpha = alpha
+        self.rows = rows
+        self.count = len(rows) if rows is not None else len(frames)
+        self.w, self.h = size or (frames.shape[2], frames.shape[1])
+        self.x0, self.y0 = offset
+        self.frames.setflags(write=False)
+        self.alpha.setflags(write=False)
+
+    @property
+    def nbytes(self):
+        return self.frames.nbytes + self.alpha.nbytes
+
+    def frame_index(self, t):
+        i = max(0, min(self.count - 1, int(round(t * self.fps))))
+        return self.rows[i] if self.rows is not None else i
+
+    def get_frame(self, t):
+        return self.frames[self.frame_index(t)]
+
+    def get_alpha(self, t):
+        return self.alpha[self.frame_index(t)]
+
+
+def alpha_sidecar_path(name, scale):
+    """预计算alpha的存放位置：与素材放在一起，如 meme/冷漠.0.35.alpha.npz"""
+    return catalog.path("meme", f"{name}.{scale:g}.alpha.npz")
+
+
+def load_alpha_sidecar(name, scale):
+    path = alpha_sidecar_path(name, scale)
+    if not os.path.exists(path):
+        return None
+    if os.path.getmtime(path) < os.path.getmtime(catalog.meme_path(name)):
+        return None
+    try:
+        with np.load(path) as data:
+            n, h, w = (int(v) for v in data["shape"])
+            bits = np.unpackbits(data["alpha"], count=n * h * w)
+    except Exception as e:
+        print(f"警告: 无法读取alpha文件 {path}: {e}")
+        return None
+    return (bits.reshape(n, h, w) * 255).astype(np.uint8)
+
+
+def save_alpha_sidecar(name, scale, alpha):
+    path = alpha_sidecar_path(name, scale)
+    tmp = path + ".tmp.npz"
+    # alpha只有0/255两种取值，按位打包后压缩存储
+    np.savez_compressed(tmp, alpha=np.packbits(alpha > 0), shape=np.array(alpha.shape))
+    os.replace(tmp, path)
+
+
+def _sample_meme(name, scale, duration, fps=24, fast=False):
+    """
+    按渲染帧率采样 meme/{name}.mp4：短于duration时循环播放
+    返回 (每个渲染帧对应的原始帧号, {原始帧号: 缩放后的画面}, 原始帧数)
+    """
+    from moviepy.video.io.VideoFileClip import VideoFileClip
+    from moviepy.video.fx.resize import resizer
+
+    target = None
+    if fast:
+        w, h = asset_index.meme(name)["size"]
+        target = (int(h * scale), int(w * scale))
+    clip = VideoFileClip(catalog.meme_path(name), audio=False, target_resolution=target, resize_algorithm="area")
+    try:
+        w, h = clip.size
+        newsize = (w * scale, h * scale)
+        if duration > 0:
+            times = np.arange(0, duration, 1.0 / fps)
+        else:
+            times = [0]
+        # 与 moviepy 的 reader.get_frame(t) 取帧规则保持一致
+        nframes = clip.reader.nframes
+        indices = []
+        for t in times:
+            if duration > 0 and clip.duration < duration:
+                t = t % clip.duration
+            indices.append(min(int(clip.reader.fps * t + 0.00001), nframes - 1))
+        wanted = set(indices)
+        small = {}
+        clip.reader.initialize()
+        for i in range(max(indices) + 1):
+            frame = clip.reader.read_frame()
+            if i in wanted:
+                small[i] = frame if fast else resizer(frame, newsize)
+    finally:
+        clip.close()
+    return indices, small, nframes
+
+
+def decode_meme(name, scale, duration, fps=24, fast=False):
+    """
+    解码 meme/{name}.mp4：短于duration时循环播放，缩放后按fps采样
+    alpha优先读取预计算的sidecar文件，没有时只为采样到的帧现场计算
+    fast: 由ffmpeg在解码时直接缩小画面（预览用），不再读取原尺寸的帧再逐帧缩放
+    """
+    indices, small, nframes = _sample_meme(name, scale, duration, fps, fast)
+    frames = np.ascontiguousarray(np.stack([small[i] for i in indices]), dtype=np.uint8)
+    native_alpha = load_alpha_sidecar(name, scale)
+    if native_alpha is not None and len(native_alpha) == nframes:
+        alpha = np.ascontiguousarray(native_alpha[indices])
+    else:
+        alpha = chroma_key_alpha(frames)
+    return MemeAsset(name, scale, duration, fps, frames, alpha)
+
+
+def compute_native_alpha(name, scale):
+    """逐帧解码整段素材，计算缩放后每一帧的alpha"""
+    from moviepy.video.io.VideoFileClip import VideoFileClip
+    from moviepy.video.fx.resize import resizer
+
+    clip = VideoFileClip(catalog.meme_path(name), audio=False)
+    try:
+        w, h = clip.size
+        newsize = (w * scale, h * scale)
+        clip.reader.initialize()
+        alpha = [chroma_key_alpha(resizer(clip.reader.read_frame(), newsize))
+                 for _ in range(clip.reader.nframes)]
+    finally:
+        clip.close()
+    return np.stack(alpha)
+
+
+def build_alpha_masks(scale=MEME_SCALE, force=False):
+    """离线预处理：为 meme/ 下的所有素材生成alpha sidecar文件"""
+    for name in catalog.memes:
+        if not force and load_alpha_sidecar(name, scale) is not None:
+            continue
+        save_alpha_sidecar(name, scale, compute_native_alpha(name, scale))
+        print(f"已生成alpha: {alpha_sidecar_path(name, scale)}")
+
+
+def atlas_paths(scale, fps):
+    """帧图集索引的位置，如 cache/meme_atlas.0.35.24fps.json；数据文件名记录在索引中"""
+    base = catalog.path("cache", f"meme_atlas.{scale:g}.{fps}fps")
+    return base + ".json", base
+
+
+def atlas_entry(name, scale, fps, seconds, fast=False):
+    """
+    解码单个meme写入图集（或共享内存）的内容：与 decode_meme 相同的采样规则，
+    相同的原始帧只保存一次，并裁剪到所有帧不透明区域的外接矩形
+    返回 (rgb, alpha, {"rows", "size", "crop"})
+    """
+    indices, small, nframes = _sample_meme(name, scale, seconds, fps, fast)
+    unique = sorted(set(indices))
+    row_of = {i: r for r, i in enumerate(unique)}
+    frames = np.stack([small[i] for i in unique]).astype(np.uint8)
+    native_alpha = load_alpha_sidecar(name, scale)
+    if native_alpha is not None and len(native_alpha) == nframes:
+        alpha = np.ascontiguousarray(native_alpha[unique])
+    else:
+        alpha = chroma_key_alpha(frames)
+    h, w = frames.shape[1], frames.shape[2]
+    ys, xs = np.nonzero(alpha.any(axis=0))
+    if len(ys):
+        x0, y0, x1, y1 = int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1
+    else:
+        x0, y0, x1, y1 = 0, 0, w, h
+    rgb = np.ascontiguousarray(frames[:, y0:y1, x0:x1])
+    alpha = np.ascontiguousarray(alpha[:, y0:y1, x0:x1])
+    return rgb, alpha, {"rows": [row_of[i] for i in indices], "size": [w, h], "crop": [x0, y0]}
+
+
+def atlas_asset(name, scale, fps, duration, rgb, alpha, entry):
+    """由 atlas_entry 格式的数据（图集或共享内存中的视图）构造时长为duration的素材"""
+    count = len(np.arange(0, duration, 1.0 / fps)) if duration > 0 else 1
+    return MemeAsset(name, scale, duration, fps, rgb, alpha,
+                     entry["rows"][:count], tuple(entry["size"]), tuple(entry["crop"]))
+
+
+def build_meme_atlas(scale=MEME_SCALE, fps=24, seconds=ATLAS_SECONDS, names=None):
+    """
+    离线预处理：把所有meme按渲染缩放比例和帧率解码一次，写入帧图集
+    每个meme保存前 seconds 秒（短于该时长的循环播放），更长的场景渲染时回退为现场解码
+    """
+    index_path, base = atlas_paths(scale, fps)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    # 数据文件名带上生成时间：重新生成时正在渲染的进程仍映射着旧文件，不会读到错位的数据
+    data_name = f"{os.path.basename(base)}.{time.time_ns():x}.bin"
+    data_path = catalog.path("cache", data_name)
+    entries = {}
+    offset = 0
+    with open(data_path, "wb") as f:
+        for name in names or catalog.memes:
+            st = os.stat(catalog.meme_path(name))
+            rgb, alpha, entry = atlas_entry(name, scale, fps, seconds)
+            f.write(rgb.tobytes())
+            f.write(alpha.tobytes())
+            entry.update({"offset": offset, "shape": list(alpha.shape),
+                          "size_bytes": st.st_size, "mtime_ns": st.st_mtime_ns})
+            entries[name] = entry
+            offset += rgb.nbytes + alpha.nbytes
+            print(f"已写入帧图集: {name}（{len(alpha)} 帧，{rgb.shape[2]}x{rgb.shape[1]}）")
+    old = None
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            old = json.load(f).get("file")
+    except (OSError, ValueError):
+        pass
+    tmp = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"scale": scale, "fps": fps, "seconds": seconds, "file": data_name, "memes": entries},
+                  f, ensure_ascii=False)
+    os.replace(tmp, index_path)
+    if old and old != data_name:
+        try:
+            os.remove(catalog.path("cache", old))
+        except OSError:
+            pass
+    print(f"帧图集已保存到: {data_path}（{len(entries)} 个meme，{offset / 1024 / 1024:.0f} MB）")
+
+
+class MemeAtlas:
+    """
+    预先解码的meme帧图集（由 build_meme_atlas 生成）
+    渲染时用 np.memmap 映射整个数据文件，按索引切片得到只读视图，不复制数据也不启动ffmpeg；
+    多个渲染进程映射同一个文件，共享操作系统的页缓存，而不是各自保存一份解码结果
+    数据文件中每个meme依次保存 RGB 帧 (n, h, w, 3) 和 alpha (n, h, w)
+    """
+    def __init__(self, scale=MEME_SCALE, fps=24):
+        self.scale = scale
+        self.fps = fps
+        self._index = None
+        self._data = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._index is None:
+                index_path, _ = atlas_paths(self.scale, self.fps)
+                try:
+                    with open(index_path, "r", encoding="utf-8") as f:
+                        index = json.load(f)
+                    self._data = np.memmap(catalog.path("cache", index["file"]), dtype=np.uint8, mode="r")
+                    self._index = index
+                except (OSError, ValueError, KeyError):
+                    self._index = {}
+            return self._index
+
+    def get(self, name, duration):
+        """图集中的素材；不在图集中、时长超出或素材文件已修改时返回None"""
+        index = self._load()
+        entry = index.get("memes", {}).get(name)
+        if entry is None or duration > index["seconds"]:
+            return None
+        try:
+            st = os.stat(catalog.meme_path(name))
+        except FileNotFoundError:
+            return None
+        if entry["size_bytes"] != st.st_size or entry["mtime_ns"] != st.st_mtime_ns:
+            return None
+        n, h, w = entry["shape"]
+        start = entry["offset"]
+        rgb = self._data[start:start + n * h * w * 3].reshape(n, h, w, 3)
+        alpha = self._data[start + n * h * w * 3:start + n * h * w * 4].reshape(n, h, w)
+        return atlas_asset(name, self.scale, self.fps, duration, rgb, alpha, entry)
+
+
+class MemeAssetCache:
+    """
+    进程内共享的猫meme素材缓存
+    以 (meme名, 缩放比例, 时长, 帧率, 是否快速解码) 为键，按占用字节数做LRU淘汰
+    依次查找：主进程发布的共享内存素材（shared，见 shared_assets）、帧图集、进程内LRU，最后现场解码；
+    前两者是共享的只读视图，不占用缓存
+    """
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, loader=decode_meme, use_atlas=ATLAS_ENABLED):
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self.use_atlas = use_atlas
+        self.shared = None
+        self._atlases = {}
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.atlas_hits = 0
+
+    def _atlas(self, scale, fps):
+        key = (round(scale, 6), fps)
+        with self._lock:
+            atlas = self._atlases.get(key)
+            if atlas is None:
+                atlas = self._atlases[key] = MemeAtlas(scale, fps)
+            return atlas
+
+    def in_atlas(self, name, scale, duration, fps=24):
+        return self.use_atlas and self._atlas(scale, fps).get(name, duration) is not None
+
+    def get(self, name, scale, duration, fps=24, fast=False):
+        if self.shared is not None:
+            asset = self.shared.meme(name, scale, duration, fps, fast)
+            if asset is not None:
+                return asset
+        if self.use_atlas:
+            asset = self._atlas(scale, fps).get(name, duration)
+            if asset is not None:
+                with self._lock:
+                    self.atlas_hits += 1
+                return asset
+        key = (name, scale, round(float(duration), 3), fps, fast)
+        with self._lock:
+            asset = self._entries.get(key)
+            if asset is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return asset
+            self.misses += 1
+        asset = self.loader(name, scale, duration, fps, fast)
+        self._put(key, asset)
+        return asset
+
+    def _put(self, key, asset):
+        with self._lock:
+            if key in self._entries or asset.nbytes > self.max_bytes:
+                return
+            self._entries[key] = asset
+            self._bytes += asset.nbytes
+            while self._bytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= old.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "atlas_hits": self.atlas_hits,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+meme_cache = MemeAssetCache()
+
+
+def decode_background(path, width, fast=False):
+    """
+    读取背景图片并按宽度缩放，返回RGB数组
+    fast: JPEG按DCT缩放解码到接近目标的尺寸再缩放（预览用），大图解码快很多
+    """
+    from PIL import Image
+    if fast:
+        with Image.open(path) as img:
+            w, h = img.size
+            size = (width, int(h * width / w))
+            img.draft("RGB", size)
+            return np.asarray(img.convert("RGB").resize(size, Image.BILINEAR))
+    from moviepy.video.VideoClip import ImageClip
+    from moviepy.video.fx.resize import resize
+    return np.ascontiguousarray(resize(ImageClip(path), width=width).get_frame(0)[:, :, :3])
+
+
+class BackgroundCache:
+    """
+    解码并缩放好的背景图片缓存
+    以 (图片路径, 目标宽度, 是否快速解码) 为键并校验文件修改时间，按占用字节数做LRU淘汰；
+    地点先经 catalog.background_path 解析为图片路径，不存在的地点与默认背景共用一份
+    同一个故事的场景大多使用相同的背景，每个地点只需解码一次；返回的数组是只读的
+    """
+    def __init__(self, max_bytes=DEFAULT_BACKGROUND_CACHE_BYTES, loader=decode_background):
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path, width, fast=False):
+        mtime = os.stat(path).st_mtime_ns
+        key = (os.path.abspath(path), int(width), bool(fast))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == mtime:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        image = self.loader(path, width, fast)
+        image.setflags(write=False)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1].nbytes
+            if image.nbytes <= self.max_bytes:
+                self._entries[key] = (mtime, image)
+                self._bytes += image.nbytes
+                while self._bytes > self.max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self._bytes -= evicted.nbytes
+                    self.evictions += 1
+        return image
+
+    def prewarm(self, width=1080, fast=False, places=None):
+        """预先解码所有背景（或places中的背景），常驻进程启动时调用"""
+        places = places or catalog.backgrounds
+        for place in places:
+            self.get(catalog.background_path(place), width, fast)
+        print(f"已预加载 {len(places)} 张背景图片（{self._bytes / 1024 / 1024:.0f} MB）")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+background_cache = BackgroundCache()
+
+
+if __name__ == "__main__":
+    import sys
+    # python assets.py            生成alpha sidecar文件
+    # python assets.py atlas      生成帧图集（在alpha之后运行，直接使用alpha文件）
+    if sys.argv[1:2] == ["atlas"]:
+        build_meme_atlas()
+    else:
+        build_alpha_masks()
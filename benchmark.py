@@ -0,0 +1,294 @@
+"""
+渲染性能基准测试（离线运行，不调用LLM）
+
+    python benchmark.py                          # 全部阶段，取 script.jsonl 前3个场景
+    python benchmark.py --scenes 5 --output bench.json
+    python benchmark.py --stages compositor text
+
+各阶段记录耗时、帧率、编码耗时，最后输出进程峰值内存，并写出JSON便于多次运行之间对比
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import contextlib
+import numpy as np
+from PIL import Image
+from assets import decode_meme, meme_cache, MEME_SCALE
+from catalog import catalog
+import movie
+from movie import chroma_key_paste, FrameCompositor
+
+STAGES = ["compositor", "text", "compose_multi_memes", "AddMeme", "concatenate_videos"]
+
+
+def _timeit(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def _peak_rss_mb():
+    """
+    本进程的峰值常驻内存，单位MB
+    不统计子进程：Linux 上 RUSAGE_CHILDREN 的 ru_maxrss 记录的是 fork 出的Python进程在 exec 之前的大小，
+    并不是ffmpeg本身的内存
+    """
+    # ru_maxrss 在 Linux 上单位是KB，在 macOS 上是字节
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit, 1)
+
+
+class _FrameTimer:
+    """包装 make_frame，累计真正写出过程中生成帧的耗时和帧数"""
+    def __init__(self, make_frame):
+        self.make_frame = make_frame
+        self.frames = 0
+        self.seconds = 0.0
+
+    def __call__(self, t):
+        start = time.perf_counter()
+        frame = self.make_frame(t)
+        self.seconds += time.perf_counter() - start
+        self.frames += 1
+        return frame
+
+
+@contextlib.contextmanager
+def _record_writes(records):
+    """
+    记录每次 write_videofile / encoder.encode_clip 的耗时
+    只写出一遍：写出时包装 make_frame 统计生成帧的耗时，(写出耗时 - 生成帧耗时) 即编码耗时
+    """
+    from moviepy.video.VideoClip import VideoClip
+    original = VideoClip.write_videofile
+
+    def record(filename, timer, write):
+        records.append({
+            "file": os.path.basename(filename),
+            "frames": timer.frames,
+            "composite_s": timer.seconds,
+            "write_s": write,
+            "encode_s": max(0.0, write - timer.seconds),
+        })
+
+    def write_videofile(self, filename, *args, **kwargs):
+        make_frame = self.make_frame
+        timer = self.make_frame = _FrameTimer(make_frame)
+        start = time.perf_counter()
+        try:
+            result = original(self, filename, *args, **kwargs)
+        finally:
+            self.make_frame = make_frame
+        record(filename, timer, time.perf_counter() - start)
+        return result
+
+    original_encode = movie.encode_clip
+
+    def encode_clip(output_path, make_frame, duration, size, *args, **kwargs):
+        timer = _FrameTimer(make_frame)
+        start = time.perf_counter()
+        result = original_encode(output_path, timer, duration, size, *args, **kwargs)
+        record(output_path, timer, time.perf_counter() - start)
+        return result
+
+    VideoClip.write_videofile = write_videofile
+    movie.encode_clip = encode_clip
+    try:
+        yield records
+    finally:
+        VideoClip.write_videofile = original
+        movie.encode_clip = original_encode
+
+
+def _summarize(wall, records):
+    frames = sum(r["frames"] for r in records)
+    encode = sum(r["encode_s"] for r in records)
+    composite = sum(r["composite_s"] for r in records)
+    return {
+        "wall_s": round(wall, 3),
+        "frames": frames,
+        "fps": round(frames / wall, 2) if wall else None,
+        "composite_s": round(composite, 3),
+        "composite_fps": round(frames / composite, 2) if composite else None,
+        "encode_s": round(encode, 3),
+    }
+
+
+def load_story(script_file, scenes):
+    story = []
+    with open(script_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                story.append(json.loads(line))
+    return story[:scenes]
+
+
+def bench_compositor(place="school", memes=("冷漠", "呆滞"), repeat=50):
+    """对比 chroma_key_paste 与 FrameCompositor 合成一帧（多个meme）的耗时"""
+    img = Image.open(catalog.background_path(place)).convert("RGB")
+    h = int(img.height * 1080 / img.width)
+    bg = np.array(img.resize((1080, h), Image.LANCZOS))
+    assets = [decode_meme(name, MEME_SCALE, 0) for name in memes]
+    positions = [(80, h - a.h - 140) if i % 2 == 0 else (1080 - a.w - 80, h - a.h - 140)
+                 for i, a in enumerate(assets)]
+
+    def legacy():
+        frame = bg
+        for a, (x, y) in zip(assets, positions):
+            frame = chroma_key_paste(a.frames[0], frame, x, y)
+        return frame
+
+    compositor = FrameCompositor()
+    out = np.empty_like(bg)
+    layers = [(a.frames[0], a.alpha[0], x, y) for a, (x, y) in zip(assets, positions)]
+
+    def fixed_point():
+        return compositor.composite(bg, layers, out=out)
+
+    if not np.array_equal(legacy(), fixed_point()):
+        print("警告: 两种合成结果不一致")
+    t_legacy = _timeit(legacy, repeat)
+    t_new = _timeit(fixed_point, repeat)
+    print(f"chroma_key_paste: {t_legacy * 1000:.2f} ms/帧")
+    print(f"FrameCompositor:  {t_new * 1000:.2f} ms/帧")
+    print(f"加速比: {t_legacy / t_new:.1f}x")
+    return {"chroma_key_paste_ms": round(t_legacy * 1000, 3),
+            "frame_compositor_ms": round(t_new * 1000, 3),
+            "speedup": round(t_legacy / t_new, 2)}
+
+
+def bench_text(story, repeat=3):
+    """create_text_clip_pil：首次渲染与命中缓存后的耗时"""
+    texts = []
+    for scene in story:
+        texts.append((movie.AddNewline(scene.get("label", "")), 1000, 60))
+        for m in scene.get("memes", []):
+            texts.append((str(m.get("d_name") or m.get("name")), 300, 42))
+            if m.get("text"):
+                texts.append((str(m["text"]), 400, 40))
+    movie.render_text_image.cache_clear()
+    start = time.perf_counter()
+    for text, width, fontsize in texts:
+        movie.create_text_clip_pil(text, 1, width=width, fontsize=fontsize)
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text, width, fontsize in texts:
+            movie.create_text_clip_pil(text, 1, width=width, fontsize=fontsize)
+    warm = (time.perf_counter() - start) / repeat
+    print(f"create_text_clip_pil: {len(texts)} 段文字，首次 {cold:.3f}s，缓存后 {warm:.4f}s")
+    return {"calls": len(texts), "cold_s": round(cold, 4), "warm_s": round(warm, 4)}
+
+
+def bench_compose(story):
+    """按 process_jsonl_story 的方式逐个渲染场景，返回生成的片段"""
+    records = []
+    scenes = []
+    outputs = []
+    start = time.perf_counter()
+    with _record_writes(records):
+        for i, scene in enumerate(story):
+            memes = scene.get("memes") or []
+            duration = movie.compute_scene_duration(memes, scene.get("duration", 3))
+            label = movie.AddNewline(scene.get("label", ""))
+            t0 = time.perf_counter()
+            movie.compose_multi_memes(scene.get("backgrounds", "home"), f"bench{i}", label, memes, duration)
+            scenes.append({"scene": i, "duration": round(duration, 3),
+                           "wall_s": round(time.perf_counter() - t0, 3)})
+            outputs.append(f"outbench{i}.mp4")
+    result = _summarize(time.perf_counter() - start, records)
+    result["scenes"] = scenes
+    result["meme_cache"] = meme_cache.stats()
+    print(f"compose_multi_memes: {len(story)} 个场景 {result['wall_s']}s, {result['fps']} 帧/秒, "
+          f"编码 {result['encode_s']}s")
+    return result, outputs
+
+
+def bench_addmeme(story, duration=2):
+    """旧版单meme流程：BgVideo 生成背景视频后由 AddMeme 抠图合成"""
+    scene = story[0] if story else {}
+    memes = scene.get("memes") or [{"name": "冷漠"}]
+    emo = memes[0].get("name", "冷漠")
+    place = scene.get("backgrounds", "home")
+    movie.BgVideo(movie.AddNewline(scene.get("label", "")), place, "bench", duration)
+    records = []
+    start = time.perf_counter()
+    with _record_writes(records):
+        ok = movie.AddMeme(emo, "bench", duration)
+    result = _summarize(time.perf_counter() - start, records)
+    result["ok"] = ok
+    for f in ("backgroundsbench.mp4", "bench.mp4"):
+        path = os.path.join(movie.output_folder, f)
+        if os.path.exists(path):
+            os.remove(path)
+    print(f"AddMeme: {result['wall_s']}s, {result['fps']} 帧/秒, 编码 {result['encode_s']}s")
+    return result
+
+
+def bench_concatenate(outputs):
+    output_file = os.path.join(movie.output_folder, "bench_story.mp4")
+    result = {}
+    for mode in ("auto", "reencode"):
+        start = time.perf_counter()
+        movie.concatenate_videos(movie.output_folder, outputs, output_file, mode=mode)
+        result[f"{mode}_s"] = round(time.perf_counter() - start, 3)
+        if os.path.exists(output_file):
+            os.remove(output_file)
+    print(f"concatenate_videos: 码流拷贝 {result['auto_s']}s，重新编码 {result['reencode_s']}s")
+    return result
+
+
+def run(script_file="script.jsonl", scenes=3, stages=STAGES):
+    story = load_story(script_file, scenes)
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "script": script_file,
+        "scenes": len(story),
+        "stages": {},
+    }
+    outputs = []
+    try:
+        if "compositor" in stages:
+            report["stages"]["compositor"] = bench_compositor()
+        if "text" in stages:
+            report["stages"]["text"] = bench_text(story)
+        if "compose_multi_memes" in stages or "concatenate_videos" in stages:
+            report["stages"]["compose_multi_memes"], outputs = bench_compose(story)
+        if "AddMeme" in stages:
+            report["stages"]["AddMeme"] = bench_addmeme(story)
+        if "concatenate_videos" in stages and outputs:
+            report["stages"]["concatenate_videos"] = bench_concatenate(outputs)
+    finally:
+        for f in outputs:
+            path = os.path.join(movie.output_folder, f)
+            if os.path.exists(path):
+                os.remove(path)
+    report["peak_rss_mb"] = _peak_rss_mb()
+    print(f"峰值内存: {report['peak_rss_mb']} MB")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="movie.py 渲染性能基准测试")
+    parser.add_argument("--script", default="script.jsonl", help="场景脚本JSONL文件")
+    parser.add_argument("--scenes", type=int, default=3, help="使用前N个场景")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--output", default="benchmark.json", help="JSON结果输出路径")
+    args = parser.parse_args()
+    report = run(args.script, args.scenes, args.stages)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
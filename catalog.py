@@ -0,0 +1,192 @@
+import os
+import json
+import threading
+
+# 素材根目录（包含 backgrounds/、meme/、meme_audio/），默认为代码所在目录，与当前工作目录无关
+ASSET_ROOT = os.environ.get('ASSET_ROOT', os.path.dirname(os.path.abspath(__file__)))
+# 素材元数据索引的保存位置
+ASSET_INDEX = os.environ.get('ASSET_INDEX', os.path.join(ASSET_ROOT, "cache", "asset_index.json"))
+
+
+class AssetCatalog:
+    """
+    素材目录
+    首次用到时才扫描目录，扫描结果按目录的修改时间缓存：增删素材后自动重新扫描
+    """
+    FOLDERS = {
+        "backgrounds": (".jpg",),
+        "meme": (".mp4",),
+        "meme_audio": (".mp3", ".MP3"),
+    }
+
+    def __init__(self, root=ASSET_ROOT):
+        self.root = root
+        self._scans = {}
+        self._lock = threading.Lock()
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def _mtime(self, folder):
+        try:
+            return os.stat(self.path(folder)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def names(self, folder):
+        """folder 下素材的名字（去掉扩展名），按文件名排序"""
+        mtime = self._mtime(folder)
+        with self._lock:
+            scan = self._scans.get(folder)
+            if scan is not None and scan[0] == mtime:
+                return scan[1]
+        exts = self.FOLDERS[folder]
+        files = sorted(os.listdir(self.path(folder))) if mtime is not None else []
+        names = []
+        for f in files:
+            name, ext = os.path.splitext(f)
+            if ext in exts and name not in names:
+                names.append(name)
+        with self._lock:
+            self._scans[folder] = (mtime, names)
+        return names
+
+    @property
+    def backgrounds(self):
+        return self.names("backgrounds")
+
+    @property
+    def memes(self):
+        return self.names("meme")
+
+    @property
+    def audios(self):
+        return self.names("meme_audio")
+
+    def version(self):
+        """各素材目录的修改时间，素材增删后会变化"""
+        return tuple(self._mtime(folder) for folder in self.FOLDERS)
+
+    def background_path(self, place, default="home"):
+        """背景图片路径，不存在时使用默认背景"""
+        path = self.path("backgrounds", f"{place}.jpg")
+        if not os.path.exists(path):
+            path = self.path("backgrounds", f"{default}.jpg")
+        return path
+
+    def meme_path(self, name):
+        return self.path("meme", f"{name}.mp4")
+
+    def audio_path(self, name):
+        """meme对应的音频路径，没有音频时返回None"""
+        for ext in self.FOLDERS["meme_audio"]:
+            path = self.path("meme_audio", f"{name}{ext}")
+            if os.path.exists(path):
+                return path
+        return None
+
+
+catalog = AssetCatalog()
+
+
+def probe_asset(path):
+    """读取单个素材的元数据：图片只读文件头，视频和音频通过 ffmpeg -i 解析，不解码画面"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".jpg":
+        from PIL import Image
+        with Image.open(path) as img:
+            return {"size": list(img.size)}
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+    infos = ffmpeg_parse_infos(path)
+    if ext == ".mp4":
+        return {"duration": infos["video_duration"], "fps": infos["video_fps"],
+                "nframes": infos["video_nframes"], "size": list(infos["video_size"])}
+    return {"duration": infos["duration"]}
+
+
+class AssetIndex:
+    """
+    素材元数据索引：meme视频的时长、帧率、帧数、原始尺寸，音频时长，背景图片尺寸
+    保存为JSON，按文件大小和修改时间判断是否需要重新读取，
+    使整个故事的时长和布局可以在打开任何解码器之前规划好
+    """
+    def __init__(self, catalog, path=ASSET_INDEX):
+        self.catalog = catalog
+        self.path = path
+        self._entries = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        # 串行化写文件，避免较旧的快照晚于较新的快照落盘
+        self._save_lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def info(self, path):
+        """path 对应素材的元数据，文件不存在时返回None"""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        key = os.path.relpath(path, self.catalog.root)
+        with self._lock:
+            entry = self._load().get(key)
+        if entry is not None and entry["size_bytes"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            return entry
+        entry = {"size_bytes": st.st_size, "mtime_ns": st.st_mtime_ns, **probe_asset(path)}
+        with self._lock:
+            self._entries[key] = entry
+            self._dirty = True
+        return entry
+
+    def meme(self, name):
+        return self.info(self.catalog.meme_path(name))
+
+    def audio_duration(self, name):
+        path = self.catalog.audio_path(name)
+        entry = self.info(path) if path else None
+        return entry["duration"] if entry else None
+
+    def background_size(self, place):
+        return tuple(self.info(self.catalog.background_path(place))["size"])
+
+    def save(self):
+        """有新读取的元数据时写回索引文件"""
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                data = dict(self._entries)
+                self._dirty = False
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=1, sort_keys=True)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print(f"警告: 写入素材索引失败: {e}")
+
+    def build(self):
+        """离线预处理：读取所有素材的元数据并保存"""
+        for name in self.catalog.memes:
+            self.meme(name)
+        for name in self.catalog.audios:
+            self.audio_duration(name)
+        for place in self.catalog.backgrounds:
+            self.background_size(place)
+        self.save()
+        print(f"素材索引已保存到: {self.path}（{len(self._entries)} 个文件）")
+
+
+asset_index = AssetIndex(catalog)
+
+
+if __name__ == "__main__":
+    asset_index.build()
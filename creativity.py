@@ -1,33 +1,33 @@
 import os
-from openai import OpenAI
 from dotenv import load_dotenv
 from prompt import PromptTemplate,query2script_prompt
+from llm import chat_completion, client_pool, prompt_cache_params, llm_cache, no_cache
 
 load_dotenv()
+q2s = PromptTemplate(
+    system_template=(query2script_prompt),
+    user_template=("这是一段用户输入文本，请按照要求生成脚本：{user_input}")
+).prerender()
+
 def init_client():
     api_key = os.environ.get('CREATIVITY_API_KEY')
     BASE_URL = os.environ.get('BASE_URL')
     if not api_key:
         raise ValueError("CREATIVITY_API_KEY 未设置，请检查.env文件")
-    return OpenAI(
-        api_key=api_key,
-        base_url=BASE_URL,
-    )
+    return client_pool.get(api_key, BASE_URL)
 
-def get_text(input_text='帮我按照格式生成一个HKU校园爽剧，要翻转打脸', output_file="text.txt"):
+def get_text(input_text='帮我按照格式生成一个HKU校园爽剧，要翻转打脸', output_file="text.txt", use_cache=None):
+    """
+    生成创意文本
+    创意文本每次都应该不同，默认不使用LLM响应缓存；use_cache=True 或 CREATIVITY_CACHE=1 时相同输入复用上次的结果
+    """
+    if use_cache is None:
+        use_cache = os.environ.get('CREATIVITY_CACHE', '0') == '1'
     client = init_client()
     MODEL = os.environ.get('MODEL')
-    q2s = PromptTemplate(
-        system_template=(query2script_prompt),
-        user_template=("这是一段用户输入文本，请按照要求生成脚本：{user_input}")
-    )
     q2s_prompt = q2s.format_messages(user_input=input_text)
-    response = client.chat.completions.create(
-        messages=q2s_prompt,
-        stream=False,
-        model=MODEL,
-    )
-    res = response.choices[0].message.content
+    res = chat_completion(client, model=MODEL, messages=q2s_prompt, cache=llm_cache if use_cache else no_cache,
+                          **prompt_cache_params(q2s))
     try:
         with open(output_file, "w", encoding="utf-8") as f:
             f.write(res)
@@ -0,0 +1,254 @@
+"""
+基于ffmpeg管道的视频编码
+合成好的帧以原始RGB数据直接写入ffmpeg的标准输入，渲染和编码参数由配置（profile）决定：
+
+    final  正式输出，1080x1080@24fps，画质优先
+    draft  快速预览，按 scale 缩小整个画面（背景、meme、字号、位置）并降低帧率，ultrafast 编码
+
+环境变量 RENDER_PROFILE 选择默认配置；RENDER_<配置名>_SCALE / _FPS / _PRESET / _CRF / _THREADS
+（如 RENDER_DRAFT_SCALE、RENDER_FINAL_CRF）覆盖对应配置的单项参数。
+RENDER_SCALE / RENDER_FPS / ENCODER_PRESET / ENCODER_CRF / ENCODER_THREADS 只作用于 RENDER_PROFILE 选中的配置，
+不会影响同一进程中渲染的其他配置（如预览后确认生成的正式视频）
+"""
+import os
+import wave
+import tempfile
+import subprocess
+import numpy as np
+
+# scale: 画面相对 1080x1080 的缩放比例，所有尺寸和位置按比例缩放，布局保持一致
+# fast_decode: 素材在解码时直接缩小（ffmpeg缩放meme、JPEG按DCT缩放解码背景），速度优先
+PROFILES = {
+    # 与 moviepy write_videofile 的默认输出一致（libx264 medium，crf 23）
+    "final": {"scale": 1.0, "fps": 24, "fast_decode": False, "preset": "medium", "crf": 23, "threads": 0,
+              "pix_fmt": "yuv420p", "tune": None},
+    # 预览：360x360@12fps，需要合成和编码的像素约为正式输出的1/18
+    "draft": {"scale": 1 / 3, "fps": 12, "fast_decode": True, "preset": "ultrafast", "crf": 28, "threads": 0,
+              "pix_fmt": "yuv420p", "tune": "fastdecode"},
+}
+
+AUDIO_FPS = 44100
+
+# (参数, RENDER_<配置名>_ 后缀, 只作用于 RENDER_PROFILE 选中配置的环境变量, 类型)
+ENV_OVERRIDES = (
+    ("scale", "SCALE", "RENDER_SCALE", float),
+    ("fps", "FPS", "RENDER_FPS", int),
+    ("preset", "PRESET", "ENCODER_PRESET", str),
+    ("crf", "CRF", "ENCODER_CRF", int),
+    ("threads", "THREADS", "ENCODER_THREADS", int),
+)
+
+
+def encoder_profile(name=None, **overrides):
+    """
+    按名字取配置，并应用环境变量和参数中的覆盖项（环境变量的作用范围见模块说明）
+    name 也可以是已经解析好的配置（dict），此时原样返回
+    """
+    if isinstance(name, dict):
+        return name
+    selected = os.environ.get('RENDER_PROFILE', 'final')
+    name = name or selected
+    if name not in PROFILES:
+        raise ValueError(f"未知的编码配置: {name}，可选: {list(PROFILES)}")
+    profile = dict(PROFILES[name], name=name)
+    for key, suffix, env, cast in ENV_OVERRIDES:
+        value = os.environ.get(f"RENDER_{name.upper()}_{suffix}")
+        if not value and name == selected:
+            value = os.environ.get(env)
+        if value:
+            profile[key] = cast(value)
+    profile.update({k: v for k, v in overrides.items() if v is not None})
+    return profile
+
+
+def scaled(value, profile):
+    """按配置的 scale 缩放一个像素值（尺寸、位置、字号等）"""
+    return int(round(value * profile["scale"]))
+
+
+def canvas_width(profile):
+    """画面宽度，取偶数（yuv420p 要求）"""
+    return 2 * max(1, int(round(540 * profile["scale"])))
+
+
+def ffmpeg_binary():
+    from moviepy.config import get_setting
+    return get_setting("FFMPEG_BINARY")
+
+
+def frame_times(duration, fps):
+    """与 moviepy write_videofile 相同的取帧时间点"""
+    return np.arange(0, duration, 1.0 / fps)
+
+
+def _video_args(profile):
+    args = ["-c:v", "libx264", "-preset", profile["preset"], "-crf", str(profile["crf"]),
+            "-pix_fmt", profile["pix_fmt"]]
+    if profile.get("threads"):
+        args += ["-threads", str(profile["threads"])]
+    if profile.get("tune"):
+        args += ["-tune", profile["tune"]]
+    return args
+
+
+class FFmpegEncoder:
+    """
+    长期运行的ffmpeg进程：逐帧写入 (h, w, 3) uint8 画面
+    audio_path 不为空时同时编码该音频（wav）并对齐到视频长度
+    """
+    def __init__(self, output_path, size, fps=None, profile=None, audio_path=None):
+        self.output_path = output_path
+        self.size = size
+        self.profile = encoder_profile(profile)
+        self.fps = fps = fps or self.profile["fps"]
+        self.frames = 0
+        w, h = size
+        cmd = [ffmpeg_binary(), "-y", "-loglevel", "error",
+               "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{w}x{h}", "-r", str(fps), "-i", "-"]
+        if audio_path:
+            cmd += ["-i", audio_path]
+        cmd += _video_args(self.profile)
+        if audio_path:
+            cmd += ["-c:a", "aac", "-shortest"]
+        else:
+            cmd += ["-an"]
+        cmd += [output_path]
+        self._stderr = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._stderr)
+
+    def write(self, frame):
+        if frame.shape[1] != self.size[0] or frame.shape[0] != self.size[1]:
+            raise ValueError(f"帧尺寸 {frame.shape[1]}x{frame.shape[0]} 与编码器 {self.size[0]}x{self.size[1]} 不一致")
+        try:
+            self.proc.stdin.write(memoryview(np.ascontiguousarray(frame, dtype=np.uint8)))
+        except BrokenPipeError:
+            self.close()
+            raise
+        self.frames += 1
+
+    def close(self):
+        if self.proc.stdin and not self.proc.stdin.closed:
+            try:
+                self.proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        code = self.proc.wait()
+        self._stderr.seek(0)
+        err = self._stderr.read().decode("utf-8", "replace").strip()
+        self._stderr.close()
+        if code != 0:
+            raise RuntimeError(f"ffmpeg编码失败（{code}）: {err[-500:]}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.proc.kill()
+            self.proc.wait()
+            self._stderr.close()
+
+
+def decode_audio(path, duration, fps=AUDIO_FPS):
+    """用ffmpeg把音频前duration秒解码为双声道int16数组"""
+    cmd = [ffmpeg_binary(), "-loglevel", "error", "-i", path, "-t", f"{duration:.6f}",
+           "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "2", "-ar", str(fps), "-"]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"音频解码失败 {path}: {result.stderr.decode('utf-8', 'replace')[-300:]}")
+    return np.frombuffer(result.stdout, dtype=np.int16).reshape(-1, 2)
+
+
+def mix_audio(paths, duration, fps=AUDIO_FPS):
+    """
+    把多段音频混合为长度正好为duration的双声道int16数组，超出部分截断，不足部分补静音
+    与 CompositeAudioClip 一样按样本相加
+    """
+    n = int(round(duration * fps))
+    mix = np.zeros((n, 2), dtype=np.int32)
+    for path in paths:
+        samples = decode_audio(path, duration, fps)
+        k = min(n, len(samples))
+        mix[:k] += samples[:k]
+    return np.clip(mix, -32768, 32767).astype(np.int16)
+
+
+def write_wav(path, samples, fps=AUDIO_FPS):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(samples.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(fps)
+        f.writeframes(samples.tobytes())
+
+
+def encode_clip(output_path, make_frame, duration, size, audio_paths=(), fps=None, profile=None):
+    """
+    编码一个片段：帧直接写入ffmpeg，音频先混合为临时wav再一起编码
+    没有音频时也写入静音音轨，使各场景片段的码流参数一致，可以直接码流拷贝合并
+    fps 默认取配置中的帧率
+    """
+    profile = encoder_profile(profile)
+    fps = fps or profile["fps"]
+    fd, wav_path = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+    try:
+        times = frame_times(duration, fps)
+        write_wav(wav_path, mix_audio(audio_paths, len(times) / fps))
+        with FFmpegEncoder(output_path, size, fps, profile, audio_path=wav_path) as enc:
+            for t in times:
+                enc.write(make_frame(t))
+    finally:
+        os.remove(wav_path)
+    return output_path
+
+
+class StoryEncoder:
+    """
+    整个故事只启动一个ffmpeg进程编码画面：所有场景的帧依次写入同一个编码器，
+    音频在内存中按场景拼接，最后与画面合并为一个文件，省去逐场景编码和合并
+    用于逐个渲染且不使用场景片段缓存时（并行渲染时场景完成顺序不确定，不能使用），参见 movie.single_encode_enabled
+    """
+    def __init__(self, output_path, size, fps=None, profile=None):
+        self.output_path = output_path
+        self.size = size
+        self.profile = encoder_profile(profile)
+        self.fps = fps or self.profile["fps"]
+        self.video_path = f"{output_path}.video.mp4"
+        self.encoder = FFmpegEncoder(self.video_path, size, fps, self.profile)
+        self.audio = []
+        self.duration = 0.0
+
+    def add_scene(self, make_frame, duration, audio_paths=()):
+        times = frame_times(duration, self.fps)
+        for t in times:
+            self.encoder.write(make_frame(t))
+        # 音频长度与实际写入的帧数对齐，避免音画逐场景累积偏移
+        scene_duration = len(times) / self.fps
+        self.audio.append(mix_audio(audio_paths, scene_duration))
+        self.duration += scene_duration
+
+    def finish(self):
+        self.encoder.close()
+        fd, wav_path = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            write_wav(wav_path, np.concatenate(self.audio) if self.audio else np.zeros((0, 2), np.int16))
+            cmd = [ffmpeg_binary(), "-y", "-loglevel", "error", "-i", self.video_path, "-i", wav_path,
+                   "-c:v", "copy", "-c:a", "aac", "-shortest", "-movflags", "+faststart", self.output_path]
+            result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            if result.returncode != 0:
+                raise RuntimeError(f"音频合并失败: {result.stderr.decode('utf-8', 'replace')[-500:]}")
+        finally:
+            os.remove(wav_path)
+            if os.path.exists(self.video_path):
+                os.remove(self.video_path)
+        return self.output_path
+
+    def abort(self):
+        self.encoder.proc.kill()
+        self.encoder.proc.wait()
+        for path in (self.video_path, self.output_path):
+            if os.path.exists(path):
+                os.remove(path)
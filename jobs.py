@@ -0,0 +1,164 @@
+import os
+import time
+import uuid
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    """
+    一次视频生成任务
+    status: queued, running, success, error
+    progress: 当前阶段以及每个场景的渲染状态
+    profile: 渲染配置（"draft" 预览 / "final" 正式），None 时读取环境变量 RENDER_PROFILE
+    script_file: 不为空时直接渲染这个脚本，不再调用LLM（预览确认后的正式渲染）
+    """
+    def __init__(self, input_text, output_dir, profile=None, script_file=None):
+        self.id = uuid.uuid4().hex
+        self.input_text = input_text
+        self.profile = profile
+        self.script_file = script_file
+        self.output_dir = os.path.join(output_dir, self.id)
+        self.video_path = os.path.join(self.output_dir, "Final_Story.mp4")
+        self.status = "queued"
+        self.message = "排队中，请稍候..."
+        self.stage = None
+        self.scenes = {}
+        self.scenes_done = 0
+        self.scenes_total = 0
+        self.created_at = time.time()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def update_progress(self, info):
+        """供 generate_video_from_input 调用的进度回调"""
+        with self._lock:
+            self.stage = info.get("stage", self.stage)
+            if "scene" in info:
+                self.scenes[str(info["scene"])] = {"status": info["status"], "error": info.get("error")}
+                self.scenes_done = info.get("done", self.scenes_done)
+                self.scenes_total = info.get("total", self.scenes_total)
+
+    def set_status(self, status, message):
+        with self._lock:
+            self.status = status
+            self.message = message
+            if status in ("success", "error"):
+                self.finished_at = time.time()
+
+    def progress(self):
+        with self._lock:
+            return {
+                "stage": self.stage,
+                "scenes_done": self.scenes_done,
+                "scenes_total": self.scenes_total,
+                "scenes": dict(self.scenes),
+            }
+
+    def to_dict(self):
+        progress = self.progress()
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "message": self.message,
+                "profile": self.profile,
+                "progress": progress,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+                "video_url": f"/video/{self.id}/Final_Story.mp4" if self.status == "success" else None,
+            }
+
+
+class JobManager:
+    """
+    视频生成任务队列：提交后立即返回任务ID，由后台线程池执行
+    每个任务使用独立的输出目录，互不覆盖
+    已结束的任务超过 ttl 秒（JOB_TTL，默认24小时）或超过 max_finished 个（JOB_MAX_FINISHED，默认50）时，
+    最早结束的任务连同输出目录一起删除
+    """
+    def __init__(self, workers=None, output_dir="results/jobs", ttl=None, max_finished=None):
+        if workers is None:
+            workers = int(os.environ.get('JOB_WORKERS', 2))
+        if ttl is None:
+            ttl = float(os.environ.get('JOB_TTL', 24 * 3600))
+        if max_finished is None:
+            max_finished = int(os.environ.get('JOB_MAX_FINISHED', 50))
+        self.output_dir = output_dir
+        self.ttl = ttl
+        self.max_finished = max_finished
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="video-job")
+
+    def submit(self, input_text, profile=None):
+        return self._submit(Job(input_text, self.output_dir, profile))
+
+    def finalize(self, job_id):
+        """
+        预览满意后渲染正式视频：复用预览任务生成的脚本，只重新渲染，返回新任务
+        预览任务不存在、未成功或没有脚本时返回None
+        """
+        draft = self.get(job_id)
+        if draft is None or draft.status != "success":
+            return None
+        script_file = os.path.join(draft.output_dir, "script_checked.jsonl")
+        if not os.path.exists(script_file):
+            return None
+        # 复制到新任务的目录，预览任务被清理后正式渲染仍能读到脚本
+        job = Job(draft.input_text, self.output_dir, "final")
+        os.makedirs(job.output_dir, exist_ok=True)
+        job.script_file = os.path.join(job.output_dir, "script_checked.jsonl")
+        shutil.copyfile(script_file, job.script_file)
+        return self._submit(job)
+
+    def _submit(self, job):
+        self.evict()
+        with self._lock:
+            self._jobs[job.id] = job
+        self._pool.submit(self._run, job)
+        return job
+
+    def evict(self, now=None):
+        """删除过期和超出数量的已结束任务及其输出目录，返回删除的任务ID"""
+        now = time.time() if now is None else now
+        with self._lock:
+            finished = sorted((job for job in self._jobs.values() if job.finished_at is not None),
+                              key=lambda job: job.finished_at)
+            expired = [job for job in finished if now - job.finished_at > self.ttl]
+            kept = [job for job in finished if now - job.finished_at <= self.ttl]
+            expired += kept[:max(0, len(kept) - self.max_finished)]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            shutil.rmtree(job.output_dir, ignore_errors=True)
+        return [job.id for job in expired]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job):
+        # 延迟导入：生成流程依赖较重，只在真正执行任务时加载
+        from video_generator import generate_video_from_input
+        from movie import process_jsonl_story
+        job.set_status("running", "视频生成中，请稍候...")
+        try:
+            if job.script_file:
+                success = process_jsonl_story(job.script_file, output_dir=job.output_dir, profile=job.profile,
+                                              progress=lambda info: job.update_progress(dict(info, stage="render")))
+            else:
+                success = generate_video_from_input(job.input_text, output_dir=job.output_dir,
+                                                    progress=job.update_progress, profile=job.profile)
+        except Exception as e:
+            job.set_status("error", f"生成过程中出现错误: {str(e)}")
+        else:
+            if success:
+                job.set_status("success", "视频生成成功！")
+            else:
+                job.set_status("error", "视频生成失败，请重试")
+        self.evict()
+
+    def shutdown(self, wait=False):
+        self._pool.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,355 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+from prompt import estimate_message_tokens
+from catalog import catalog
+
+# 下面的配置在导入时读取，creativity/script 在自己调用 load_dotenv() 之前就导入了本模块，
+# 这里先加载.env，否则写在.env中的 LLM_* 配置不会生效
+load_dotenv()
+
+# 默认放在素材根目录下，与当前工作目录无关
+DEFAULT_CACHE_DIR = os.environ.get('LLM_CACHE_DIR', catalog.path("cache", "llm"))
+# 磁盘缓存的大小上限（字节）和有效期（秒），有效期为0时不过期
+DEFAULT_CACHE_BYTES = int(os.environ.get('LLM_CACHE_BYTES', 64 * 1024 * 1024))
+DEFAULT_CACHE_TTL = float(os.environ.get('LLM_CACHE_TTL', 7 * 24 * 3600))
+# 单次请求超时（秒）与失败重试次数，重试由 openai 客户端按指数退避执行
+DEFAULT_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 120))
+DEFAULT_CONNECT_TIMEOUT = float(os.environ.get('LLM_CONNECT_TIMEOUT', 10))
+DEFAULT_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 3))
+# 设置为1时把提示词前缀哈希作为 prompt_cache_key 随请求发送，供支持前缀缓存的服务使用
+PROMPT_CACHE_KEY = os.environ.get('LLM_PROMPT_CACHE_KEY', '0') == '1'
+
+
+def _openai_client(api_key, base_url, timeout, connect_timeout, max_retries):
+    from openai import OpenAI, Timeout
+    # OpenAI 对象内部持有一个keep-alive连接池，复用同一个对象即可复用连接
+    return OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        timeout=Timeout(timeout, connect=connect_timeout),
+        max_retries=max_retries,
+    )
+
+
+class ClientPool:
+    """
+    共享的LLM客户端
+    每个 (base_url, api_key) 只创建一个客户端，所有流水线阶段和并发任务复用它的长连接池，
+    避免每次调用都重新建立连接和TLS握手
+    """
+    def __init__(self, timeout=DEFAULT_TIMEOUT, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 max_retries=DEFAULT_MAX_RETRIES, factory=_openai_client):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.factory = factory
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, api_key, base_url=None):
+        key = (base_url or "", api_key)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self.factory(api_key, base_url, self.timeout, self.connect_timeout, self.max_retries)
+                self._clients[key] = client
+            return client
+
+    def close(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            try:
+                client.close()
+            except Exception as e:
+                print(f"警告: 关闭LLM客户端失败: {e}")
+
+
+client_pool = ClientPool()
+
+
+class MemoryStore:
+    """进程内LRU存储"""
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DiskStore:
+    """
+    磁盘存储：每条响应保存为一个json文件，进程重启后仍然有效
+    超过 ttl 秒的条目视为过期；总大小超过 max_bytes 时按最近使用时间淘汰
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_BYTES, ttl=DEFAULT_CACHE_TTL):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if self.ttl and time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)["content"]
+            os.utime(path)
+            return value
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key, value):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"content": value}, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"警告: 写入LLM缓存失败: {e}")
+            return
+        self.evict()
+
+    def evict(self):
+        """删除过期条目，再按最近使用时间删除最旧的条目，直到总大小不超过上限"""
+        now = time.time()
+        entries = []
+        total = 0
+        with self._lock:
+            for root, _, files in os.walk(self.cache_dir):
+                for f in files:
+                    if not f.endswith(".json"):
+                        continue
+                    p = os.path.join(root, f)
+                    try:
+                        st = os.stat(p)
+                        if self.ttl and now - st.st_mtime > self.ttl:
+                            os.remove(p)
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, p))
+                    total += st.st_size
+            entries.sort()
+            for _, size, p in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+class _InFlight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class LLMResponseCache:
+    """
+    LLM响应缓存
+    以 (model, messages, 其余参数) 的哈希为键，按顺序查询各级存储（默认内存LRU + 磁盘）；
+    相同请求同时到达时只发出一次调用，其余请求等待并共享结果
+    """
+    def __init__(self, stores=None, enabled=None):
+        if stores is None:
+            stores = [MemoryStore(), DiskStore()]
+        if enabled is None:
+            enabled = os.environ.get('LLM_CACHE', '1') != '0'
+        self.stores = stores
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model, messages, params=None):
+        data = json.dumps({"model": model, "messages": messages, "params": params or {}},
+                          ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def lookup(self, key):
+        for i, store in enumerate(self.stores):
+            value = store.get(key)
+            if value is not None:
+                # 回填到更靠前（更快）的存储
+                for upper in self.stores[:i]:
+                    upper.put(key, value)
+                return value
+        return None
+
+    def store(self, key, value):
+        for store in self.stores:
+            store.put(key, value)
+
+    def get_or_call(self, key, fn):
+        """命中缓存直接返回；否则调用fn()，同一个key同时只有一个调用在执行"""
+        if not self.enabled:
+            return fn()
+        value = self.lookup(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = _InFlight()
+                self._inflight[key] = call
+                self.misses += 1
+            else:
+                self.deduplicated += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            # 上一个相同请求可能刚好在查询和加锁之间完成
+            call.result = self.lookup(key)
+            if call.result is not None:
+                return call.result
+            call.result = fn()
+            if call.result is not None:
+                self.store(key, call.result)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            call.event.set()
+            with self._lock:
+                del self._inflight[key]
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "deduplicated": self.deduplicated}
+
+
+llm_cache = LLMResponseCache()
+# 不读写缓存、也不合并并发请求，用于每次都应该得到新结果的调用（如创意文本）
+no_cache = LLMResponseCache(stores=[], enabled=False)
+
+
+class TokenUsage:
+    """
+    按请求统计prompt/completion token数
+    接口返回 usage 时使用真实值，否则使用 prompt.estimate_message_tokens 的估计值
+    """
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.estimated_prompt_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, messages, usage=None, label=""):
+        estimated = estimate_message_tokens(messages)
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None) or 0
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens if prompt_tokens is not None else estimated
+            self.completion_tokens += completion_tokens
+            self.estimated_prompt_tokens += estimated
+        if prompt_tokens is not None:
+            print(f"LLM请求{label}: prompt {prompt_tokens} tokens（估计 {estimated}），completion {completion_tokens} tokens")
+        else:
+            print(f"LLM请求{label}: prompt 约 {estimated} tokens（估计值）")
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "prompt_tokens": self.prompt_tokens,
+                    "completion_tokens": self.completion_tokens,
+                    "estimated_prompt_tokens": self.estimated_prompt_tokens}
+
+
+token_usage = TokenUsage()
+
+
+def prompt_cache_params(template):
+    """PromptTemplate 的前缀哈希对应的请求参数，未开启 LLM_PROMPT_CACHE_KEY 时为空"""
+    if not PROMPT_CACHE_KEY:
+        return {}
+    return {"extra_body": {"prompt_cache_key": template.prefix_hash()}}
+
+
+def chat_completion(client, model, messages, cache=None, **params):
+    """
+    调用 client.chat.completions.create 并返回回复文本，结果经过 LLM 响应缓存
+    client 可以是任何提供 chat.completions.create 的对象，便于用本地桩替换
+    """
+    cache = cache or llm_cache
+
+    def call():
+        response = client.chat.completions.create(model=model, messages=messages, stream=False, **params)
+        token_usage.record(messages, getattr(response, "usage", None))
+        return response.choices[0].message.content
+
+    return cache.get_or_call(cache.key(model, messages, params), call)
+
+
+def stream_chat_completion(client, model, messages, cache=None, **params):
+    """
+    流式版本的 chat_completion，逐段产出回复文本
+    与 chat_completion 共用同一个缓存键：命中缓存时直接产出缓存的完整回复，
+    未命中时边接收边产出，接收完整后写入缓存
+    """
+    cache = cache or llm_cache
+    key = cache.key(model, messages, params)
+    if cache.enabled:
+        value = cache.lookup(key)
+        if value is not None:
+            with cache._lock:
+                cache.hits += 1
+            yield value
+            return
+        with cache._lock:
+            cache.misses += 1
+    parts = []
+    usage = None
+    response = client.chat.completions.create(model=model, messages=messages, stream=True, **params)
+    for chunk in response:
+        # 部分服务会在最后一个chunk中附带usage
+        usage = getattr(chunk, "usage", None) or usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            yield delta
+    token_usage.record(messages, usage, "（流式）")
+    if cache.enabled and parts:
+        cache.store(key, "".join(parts))
@@ -4,16 +4,15 @@ import threading
 import time
 import webbrowser
 from flask import Flask, render_template, request, jsonify, send_file
-from video_generator import generate_video_from_input
+from jobs import JobManager
 
 app = Flask(__name__)
 
 class VideoGeneratorApp:
     def __init__(self):
         self.is_running = True
-        self.generation_status = "idle"  # idle, generating, success, error
-        self.generation_message = ""
-        self.video_path = "results/Final_Story.mp4"
+        # 每个生成请求是一个独立任务，有自己的输出目录和进度
+        self.jobs = JobManager()
 
     def shutdown_server(self):
         """关闭服务器"""
@@ -31,7 +30,7 @@ def index():
 
 @app.route('/generate-video', methods=['POST'])
 def generate_video():
-    """生成视频的API接口"""
+    """提交视频生成任务，立即返回任务ID"""
     try:
         data = request.get_json()
         input_text = data.get('text', '').strip()
@@ -42,37 +41,58 @@ def generate_video():
                 "message": "请输入文本内容"
             })
         
-        # 更新状态
-        app_state.generation_status = "generating"
-        app_state.generation_message = "视频生成中，请稍候..."
-        
-        # 调用视频生成函数
-        success = generate_video_from_input(input_text)
-        
-        if success:
-            app_state.generation_status = "success"
-            app_state.generation_message = "视频生成成功！"
-            return jsonify({
-                "success": True,
-                "message": "视频生成成功！",
-                "video_path": app_state.video_path
-            })
-        else:
-            app_state.generation_status = "error"
-            app_state.generation_message = "视频生成失败，请重试"
-            return jsonify({
-                "success": False,
-                "message": "视频生成失败，请重试"
-            })
+        # preview 为真时先以低分辨率快速渲染预览，确认后再通过 /jobs/<id>/finalize 渲染正式视频
+        job = app_state.jobs.submit(input_text, profile="draft" if data.get('preview') else None)
+        return jsonify({
+            "success": True,
+            "message": "任务已提交，视频生成中...",
+            "job_id": job.id,
+            "status_url": f"/jobs/{job.id}"
+        })
             
     except Exception as e:
-        app_state.generation_status = "error"
-        app_state.generation_message = f"生成过程中出现错误: {str(e)}"
         return jsonify({
             "success": False,
-            "message": f"生成过程中出现错误: {str(e)}"
+            "message": f"提交任务时出现错误: {str(e)}"
         })
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """查询任务状态和进度"""
+    job = app_state.jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "任务不存在"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/finalize', methods=['POST'])
+def finalize_job(job_id):
+    """预览确认后，用预览的脚本渲染正式视频（不再调用LLM），返回新任务ID"""
+    job = app_state.jobs.finalize(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "预览任务不存在或尚未完成"}), 404
+    return jsonify({
+        "success": True,
+        "message": "正式视频生成中...",
+        "job_id": job.id,
+        "status_url": f"/jobs/{job.id}"
+    })
+
+@app.route('/jobs/<job_id>/progress')
+def job_progress(job_id):
+    """查询任务的阶段和每个场景的渲染进度"""
+    job = app_state.jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "任务不存在"}), 404
+    return jsonify(job.progress())
+
+@app.route('/video/<job_id>/Final_Story.mp4')
+def serve_job_video(job_id):
+    """提供某个任务生成的视频"""
+    job = app_state.jobs.get(job_id)
+    if job is not None and job.status == "success" and os.path.exists(job.video_path):
+        return send_file(os.path.abspath(job.video_path), as_attachment=False)
+    return "Video not found", 404
+
 @app.route('/video/<filename>')
 def serve_video(filename):
     """提供视频文件访问"""
@@ -97,6 +117,11 @@ def shutdown():
     threading.Thread(target=app_state.shutdown_server).start()
     return jsonify({"message": "服务器正在关闭..."})
 
+def prewarm_backgrounds():
+    # 延迟导入：渲染模块依赖较重
+    from movie import prewarm_backgrounds
+    prewarm_backgrounds()
+
 def open_browser():
     """自动打开浏览器"""
     time.sleep(1.5)  # 等待服务器启动
@@ -111,6 +136,11 @@ def main():
     # 确保results目录存在
     os.makedirs("results", exist_ok=True)
     
+    # BACKGROUND_PREWARM=1 时在后台按预览和正式渲染的配置预先解码所有背景图片，之后的任务不再重复解码
+    # （配置列表由 BACKGROUND_PREWARM_PROFILES 指定，参见 movie.prewarm_backgrounds）
+    if os.environ.get('BACKGROUND_PREWARM', '0') == '1':
+        threading.Thread(target=prewarm_backgrounds, daemon=True).start()
+    
     # 在单独的线程中打开浏览器
     browser_thread = threading.Thread(target=open_browser)
     browser_thread.daemon = True
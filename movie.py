@@ -1,246 +1,379 @@
 import os
+import re
 import json
+import functools
+import threading
+import subprocess
 import numpy as np
-from moviepy.editor import *
 from PIL import Image, ImageDraw, ImageFont
 import textwrap
+from assets import meme_cache, background_cache, MEME_SCALE
+from render_cache import scene_cache
+from catalog import catalog, asset_index
+from encoder import encode_clip, encoder_profile, scaled, canvas_width, StoryEncoder, ffmpeg_binary
+import shared_assets
+from shared_assets import SharedAssetStore, shared_background
 
-# 确保results文件夹存在
+# moviepy 在用到时才导入：导入 moviepy.editor 需要约0.5秒（会连带导入IPython等），
+# 渲染路径只导入需要的子模块；旧版流程（BgVideo、AddMeme）仍使用 moviepy.editor
+
+# 输出目录在写文件时才创建
 output_folder = f"results"
-if not os.path.exists(output_folder):
-    os.makedirs(output_folder)
 
-def create_text_clip_pil(text, duration, width=1000, fontsize=60):
-    """使用PIL创建带透明背景的文字视频片段"""
-    
-    # 计算文字高度
-    try:
-        # 尝试加载中文字体
-        font = ImageFont.truetype("simhei.ttf", fontsize)  # 黑体
-    except:
+def _output_path(output_dir, filename):
+    folder = output_dir or output_folder
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, filename)
+
+def _load_background(image_path, width, fast=False):
+    """
+    按宽度缩放后的背景图片（只读RGB数组），参见 assets.decode_background
+    多进程渲染时优先使用主进程发布到共享内存的结果，否则经过进程内的背景缓存
+    """
+    shared = shared_background(image_path, width, fast)
+    if shared is not None:
+        return shared
+    return background_cache.get(image_path, width, fast)
+
+def prewarm_backgrounds(profiles=None):
+    """
+    按渲染配置的画面宽度预先解码所有背景，供常驻进程（如网页服务）启动时调用
+    profiles: 配置名列表，默认读取环境变量 BACKGROUND_PREWARM_PROFILES（逗号分隔，未设置时为 draft,final，
+              即网页预览和正式渲染用到的两种配置）；宽度和解码方式相同的配置只预加载一次
+    """
+    if profiles is None:
+        profiles = os.environ.get('BACKGROUND_PREWARM_PROFILES', 'draft,final').split(',')
+    done = set()
+    for name in profiles:
+        if not str(name).strip():
+            continue
+        profile = encoder_profile(str(name).strip())
+        key = (canvas_width(profile), profile["fast_decode"])
+        if key not in done:
+            done.add(key)
+            background_cache.prewarm(*key)
+
+@functools.lru_cache(maxsize=None)
+def load_font(fontsize):
+    """按字号加载中文字体，每个字号只加载一次"""
+    for font_file in ("simhei.ttf",   # 黑体
+                      "msyh.ttc",     # 微软雅黑
+                      "simsun.ttc"):  # 宋体
         try:
-            font = ImageFont.truetype("msyh.ttc", fontsize)  # 微软雅黑
-        except:
-            try:
-                font = ImageFont.truetype("simsun.ttc", fontsize)  # 宋体
-            except:
-                # 使用默认字体（可能不支持中文）
-                font = ImageFont.load_default()
-                print("警告: 使用默认字体，可能不支持中文显示")
-    
-    padding = 10
-    temp_img = Image.new('RGBA', (1, 1))
-    temp_draw = ImageDraw.Draw(temp_img)
-    def measure(s):
-        if not s:
-            return 0
-        bbox = temp_draw.textbbox((0, 0), s, font=font)
-        return bbox[2] - bbox[0]
-    def wrap_para(p):
-        lines = []
-        cur = ''
-        for ch in p:
-            t = cur + ch
-            if measure(t) <= (width - 2*padding) or cur == '':
-                cur = t
-            else:
-                lines.append(cur)
-                cur = ch
-        if cur:
+            return ImageFont.truetype(font_file, fontsize)
+        except OSError:
+            continue
+    # 使用默认字体（可能不支持中文）
+    print("警告: 使用默认字体，可能不支持中文显示")
+    return ImageFont.load_default()
+
+@functools.lru_cache(maxsize=8192)
+def _char_advance(fontsize, ch):
+    """单个字符的前进宽度，用于换行时累加计算行宽"""
+    return load_font(fontsize).getlength(ch)
+
+def _wrap_paragraph(p, fontsize, max_width):
+    lines = []
+    cur = ''
+    cur_width = 0
+    for ch in p:
+        w = _char_advance(fontsize, ch)
+        if cur_width + w <= max_width or cur == '':
+            cur += ch
+            cur_width += w
+        else:
             lines.append(cur)
-        return lines
-    paras = text.split('\n')
+            cur = ch
+            cur_width = w
+    if cur:
+        lines.append(cur)
+    return lines
+
+@functools.lru_cache(maxsize=128)
+def render_text_image(text, width=1000, fontsize=60):
+    """
+    使用PIL渲染带透明背景和描边的文字，返回 (h, width, 4) 的RGBA数组
+    结果按 (text, width, fontsize) 缓存，返回的数组是只读的
+    """
+    font = load_font(fontsize)
+    padding = 10
     lines = []
-    for p in paras:
-        lines.extend(wrap_para(p))
+    for p in text.split('\n'):
+        lines.extend(_wrap_paragraph(p, fontsize, width - 2 * padding))
     line_height = int(fontsize * 1.3)
     text_height = len(lines) * line_height + 2 * padding
     img = Image.new('RGBA', (width, text_height), color=(0, 0, 0, 0))
     draw = ImageDraw.Draw(img)
+    stroke = isinstance(font, ImageFont.FreeTypeFont)
     y_position = padding
     for line in lines:
         bbox = draw.textbbox((0, 0), line, font=font)
         text_width = bbox[2] - bbox[0]
         x_position = (width - text_width) // 2
         x_position = max(padding, min(width - text_width - padding, x_position))
-        offsets = [(-2, -2), (-2, 2), (2, -2), (2, 2), 
-                  (-1, -1), (-1, 1), (1, -1), (1, 1)]
-        for offset_x, offset_y in offsets:
-            draw.text((x_position + offset_x, y_position + offset_y), 
-                     line, font=font, fill=(0, 0, 0, 255))
-        draw.text((x_position, y_position), line, font=font, fill=(255, 255, 255, 255))
+        if stroke:
+            # 黑色描边直接由 stroke_width 绘制，不再逐个偏移重复绘制
+            draw.text((x_position, y_position), line, font=font, fill=(255, 255, 255, 255),
+                      stroke_width=2, stroke_fill=(0, 0, 0, 255))
+        else:
+            for offset_x, offset_y in [(-2, -2), (-2, 2), (2, -2), (2, 2),
+                                       (-1, -1), (-1, 1), (1, -1), (1, 1)]:
+                draw.text((x_position + offset_x, y_position + offset_y),
+                          line, font=font, fill=(0, 0, 0, 255))
+            draw.text((x_position, y_position), line, font=font, fill=(255, 255, 255, 255))
         y_position += line_height
     img_array = np.array(img)
+    img_array.setflags(write=False)
+    return img_array
+
+def create_text_clip_pil(text, duration, width=1000, fontsize=60):
+    """使用PIL创建带透明背景的文字视频片段"""
+    from moviepy.video.VideoClip import ImageClip
+    img_array = render_text_image(text, width, fontsize)
     text_clip = ImageClip(img_array, duration=duration, ismask=False)
     return text_clip
 
 def get_audio_file(name):
-    base = f"meme_audio/{name}"
-    cands = [f"{base}.mp3", f"{base}.MP3"]
-    for p in cands:
-        if os.path.exists(p):
-            return p
-    return None
+    return catalog.audio_path(name)
+
+def _meme_lines(m):
+    lines = m.get("lines")
+    if lines is None:
+        lines = m.get("text", "")
+    if isinstance(lines, list):
+        lines = "".join(lines)
+    return lines
+
+def _meme_xy(pos, w, h, canvas_w, canvas_h, margin, bottom=140):
+    if pos == 0:
+        x = (canvas_w - w) // 2
+    else:
+        x = margin if pos == 1 else (canvas_w - w - margin)
+    y = canvas_h - h - bottom
+    return x, y
+
+# 有台词的meme会播放音频：场景时长至少覆盖音频长度，但为音频延长的时长不超过该上限（秒），设为0时只按台词长度计算
+SCENE_AUDIO_CAP = float(os.environ.get('SCENE_AUDIO_CAP', 4))
 
 def compute_scene_duration(memes, fallback):
+    """场景时长：按台词长度估计（每10个字1秒，另加1秒），并参考素材索引中的音频时长"""
     ds = []
     for m in memes:
-        content = m.get("lines")
-        if content is None:
-            content = m.get("text", "")
-        if isinstance(content, list):
-            content = "".join(content)
+        content = _meme_lines(m)
         if content:
-            ds.append(1 + len(content) / 10.0)
+            d = 1 + len(content) / 10.0
+            audio = asset_index.audio_duration(m.get("name", "")) if SCENE_AUDIO_CAP > 0 else None
+            if audio:
+                d = max(d, min(audio, SCENE_AUDIO_CAP))
+            ds.append(d)
     if ds:
         return max(ds)
     return fallback
 
-def compose_multi_memes(place, scene_number, label_text, memes, duration):
-    width, height = 1080, 1080
-    image_path = f"backgrounds/{place}.jpg"
-    if not os.path.exists(image_path):
-        image_path = f"backgrounds/home.jpg"
-    bg_clip = ImageClip(image_path).resize(width=1080).set_duration(duration)
-    canvas_w, canvas_h = int(bg_clip.w), int(bg_clip.h)
-    def make_frame(t):
-        base = bg_clip.get_frame(t)
-        current = base
-        dyn = []
-        dyn_pos = []
-        stat = []
-        stat_pos = []
-        for m in memes:
-            name = m.get("name")
-            if not name:
-                continue
-            vp = f"meme/{name}.mp4"
-            if not os.path.exists(vp):
-                continue
-            lines = m.get("lines")
-            if lines is None:
-                lines = m.get("text", "")
-            if isinstance(lines, list):
-                lines = "".join(lines)
-            pos = int(m.get("position", 1))
-            if lines:
-                c = VideoFileClip(vp)
-                if c.duration < duration:
-                    c = c.loop(duration=duration)
-                else:
-                    c = c.subclip(0, duration)
-                c = c.resize(0.35)
-                w, h = c.size
-                if pos == 0:
-                    x = (canvas_w - w) // 2
-                else:
-                    x = 80 if pos == 1 else (canvas_w - w - 80)
-                y = canvas_h - h - 140
-                dyn.append(c)
-                dyn_pos.append((x, y))
-            else:
-                c = VideoFileClip(vp).resize(0.35)
-                w, h = c.size
-                if pos == 0:
-                    x = (canvas_w - w) // 2
-                else:
-                    x = 80 if pos == 1 else (canvas_w - w - 80)
-                y = canvas_h - h - 140
-                f0 = c.get_frame(0)
-                c.close()
-                stat.append(f0)
-                stat_pos.append((x, y))
-        for idx, c in enumerate(dyn):
-            gf = c.get_frame(t)
-            x, y = dyn_pos[idx]
-            current = chroma_key_paste(gf, current, x, y)
-        for idx, f0 in enumerate(stat):
-            x, y = stat_pos[idx]
-            current = chroma_key_paste(f0, current, x, y)
-        return current
-    comp = VideoClip(make_frame, duration=duration).set_fps(24)
-    label = create_text_clip_pil(label_text, duration, width=1000, fontsize=60).set_position(('center', 50))
-    attach_clips = [comp, label]
-    for m in memes:
-        nm = m.get("d_name") or m.get("name")
-        pos = int(m.get("position", 1))
-        lines = m.get("lines")
-        if lines is None:
-            lines = m.get("text", "")
-        if isinstance(lines, list):
-            lines = "".join(lines)
-        vp = f"meme/{m.get('name','')}.mp4"
-        if not os.path.exists(vp):
-            continue
-        tmp = VideoFileClip(vp).resize(0.35)
-        w, h = tmp.size
-        if pos == 0:
-            x = (canvas_w - w) // 2
+class MemeLayer:
+    """
+    场景内的单个猫meme图层，位置和缩放比例取自 plan_scene 的规划结果
+    素材从进程内缓存或帧图集取出（已循环、缩放并采样）；无台词的meme只取第一帧作为静态图
+    w/h/x/y 为实际粘贴的区域：图集中的素材只保存不透明区域，粘贴位置按裁剪偏移调整
+    """
+    def __init__(self, planned, duration, profile=None):
+        profile = encoder_profile(profile)
+        self.animated = animated = planned["animated"]
+        self.asset = meme_cache.get(planned["name"], planned["scale"], duration if animated else 0,
+                                    profile["fps"], profile["fast_decode"])
+        x, y = planned["xy"]
+        self.h, self.w = self.asset.frames.shape[1], self.asset.frames.shape[2]
+        self.x, self.y = x + self.asset.x0, y + self.asset.y0
+        self.static_frame = None if animated else self.asset.get_frame(0)
+        self.static_alpha = None if animated else self.asset.get_alpha(0)
+
+    def get_frame(self, t):
+        if self.static_frame is not None:
+            return self.static_frame
+        return self.asset.get_frame(t)
+
+    def get_alpha(self, t):
+        if self.static_alpha is not None:
+            return self.static_alpha
+        return self.asset.get_alpha(t)
+
+class StaticLayer:
+    """场景内不随时间变化的图层（标题、人物名、台词等RGBA文字）"""
+    animated = False
+
+    def __init__(self, rgba, x, y):
+        self.frame = np.ascontiguousarray(rgba[:, :, :3])
+        self.alpha = np.ascontiguousarray(rgba[:, :, 3])
+        self.h, self.w = self.frame.shape[0], self.frame.shape[1]
+        self.x, self.y = x, y
+
+    def get_frame(self, t):
+        return self.frame
+
+    def get_alpha(self, t):
+        return self.alpha
+
+def _layer_rect(layer, W, H):
+    x, y = _clamp_xy(layer.x, layer.y, layer.w, layer.h, W, H)
+    return x, y, x + layer.w, y + layer.h
+
+def flatten_static_layers(base, layers, compositor):
+    """
+    把不随时间变化的图层预先合成进底图（原地修改base）
+    layers 按从下到上的顺序排列；静态图层如果与某个逐帧绘制的图层重叠，
+    为保持遮挡关系也改为逐帧绘制。返回需要逐帧绘制的图层列表
+    """
+    H, W = base.shape[0], base.shape[1]
+    per_frame = []
+    rects = []
+    for layer in layers:
+        r = _layer_rect(layer, W, H)
+        overlaps = any(r[0] < o[2] and o[0] < r[2] and r[1] < o[3] and o[1] < r[3] for o in rects)
+        if layer.animated or overlaps:
+            per_frame.append(layer)
+            rects.append(r)
         else:
-            x = 40 if pos == 1 else (canvas_w - w - 40)
-        y = canvas_h - h - 140
-        tmp.close()
+            compositor.paste(base, layer.get_frame(0), layer.get_alpha(0), layer.x, layer.y)
+    return per_frame
+
+class SceneFrames:
+    """
+    准备好的场景：make_frame(t) 返回合成后的画面，audio 为需要混合的音频文件
+    由 encoder 逐场景编码，或在整段故事只编码一次时依次写入同一个编码器
+    """
+    def __init__(self, make_frame, duration, size, audio=()):
+        self.make_frame = make_frame
+        self.duration = duration
+        self.size = size
+        self.audio = list(audio)
+
+def prepare_multi_memes(plan, label_text, profile=None):
+    """多meme场景：meme的尺寸、位置和音频取自 plan_scene，文字的字号和位置按 profile 的 scale 缩放"""
+    profile = encoder_profile(profile)
+    base = _load_background(plan["background"], canvas_width(profile), profile["fast_decode"]).copy()
+    canvas_h, canvas_w = base.shape[0], base.shape[1]
+    duration = plan["duration"]
+    # 每个meme只在场景开始时准备一次，而不是每帧都重新解码
+    memes_layers = [(m, MemeLayer(m, duration, profile)) for m in plan["memes"]]
+    # 图层从下到上：有台词的meme、静止的meme、标题、人物名和台词
+    layers = [layer for _, layer in memes_layers if layer.animated]
+    layers += [layer for _, layer in memes_layers if not layer.animated]
+    def px(v):
+        return scaled(v, profile)
+    label_img = render_text_image(label_text, width=px(1000), fontsize=px(60))
+    layers.append(StaticLayer(label_img, (canvas_w - label_img.shape[1]) // 2, px(50)))
+    for m, layer in memes_layers:
+        nm = m["d_name"]
+        lines = m["lines"]
+        w, h = m["size"]
+        x, y = _meme_xy(m["position"], w, h, canvas_w, canvas_h, px(40), px(140))
         if nm:
-            name_w = max(100, min(w - 20, 300))
-            name_clip = create_text_clip_pil(str(nm), duration, width=name_w, fontsize=42)
-            nx = x + (w - name_clip.w) // 2
-            ny = y - 60
-            nx = max(10, min(canvas_w - name_clip.w - 10, nx))
-            ny = max(10, min(canvas_h - name_clip.h - 10, ny))
-            attach_clips.append(name_clip.set_position((nx, ny)))
+            name_w = max(px(100), min(w - px(20), px(300)))
+            name_img = render_text_image(str(nm), width=name_w, fontsize=px(42))
+            nh, nw = name_img.shape[0], name_img.shape[1]
+            nx = x + (w - nw) // 2
+            ny = y - px(60)
+            nx = max(px(10), min(canvas_w - nw - px(10), nx))
+            ny = max(px(10), min(canvas_h - nh - px(10), ny))
+            layers.append(StaticLayer(name_img, nx, ny))
         if lines:
-            line_w = max(160, min(w - 20, 400))
-            lc = create_text_clip_pil(str(lines), duration, width=line_w, fontsize=40)
-            lx = x + (w - lc.w) // 2
-            ly = y + h + 10
-            lx = max(10, min(canvas_w - lc.w - 10, lx))
-            ly = max(10, min(canvas_h - lc.h - 10, ly))
-            attach_clips.append(lc.set_position((lx, ly)))
-    final = CompositeVideoClip(attach_clips)
-    audios = []
-    for m in memes:
-        lines = m.get("lines")
-        if lines is None:
-            lines = m.get("text", "")
-        if isinstance(lines, list):
-            lines = "".join(lines)
-        if lines:
-            ap = get_audio_file(m.get("name", ""))
-            if ap and os.path.exists(ap):
-                a = AudioFileClip(ap)
-                if a.duration > duration:
-                    a = a.subclip(0, duration)
-                audios.append(a)
-    if audios:
-        final_audio = CompositeAudioClip(audios)
-        final = final.set_audio(final_audio)
-    outp = f"{output_folder}/out{scene_number}.mp4"
-    final.write_videofile(outp, codec='libx264', audio_codec='aac', fps=24, verbose=False, logger=None)
-    try:
-        bg_clip.close()
-        comp.close()
-        label.close()
-        for cl in attach_clips[2:]:
-            cl.close()
-        for a in audios:
-            a.close()
-        final.close()
-    except Exception:
-        pass
+            line_w = max(px(160), min(w - px(20), px(400)))
+            line_img = render_text_image(str(lines), width=line_w, fontsize=px(40))
+            lh, lw = line_img.shape[0], line_img.shape[1]
+            lx = x + (w - lw) // 2
+            ly = y + h + px(10)
+            lx = max(px(10), min(canvas_w - lw - px(10), lx))
+            ly = max(px(10), min(canvas_h - lh - px(10), ly))
+            layers.append(StaticLayer(line_img, lx, ly))
+    # 静态图层在场景开始时一次性压平到底图，逐帧只复制底图并叠加动态图层
+    compositor = FrameCompositor()
+    per_frame = flatten_static_layers(base, layers, compositor)
+    out_frame = np.empty_like(base)
+    def make_frame(t):
+        paste = [(layer.get_frame(t), layer.get_alpha(t), layer.x, layer.y) for layer in per_frame]
+        return compositor.composite(base, paste, out=out_frame)
+    audios = [m["audio"] for m in plan["memes"] if m["audio"]]
+    return SceneFrames(make_frame, duration, (canvas_w, canvas_h), audios)
+
+def compose_multi_memes(place, scene_number, label_text, memes, duration, output_dir=None, profile=None, plan=None):
+    """plan 为空时按 place 和 memes 规划，时长使用 duration"""
+    if plan is None:
+        plan = dict(plan_scene({"backgrounds": place, "memes": memes}, profile=profile), duration=duration)
+    scene = prepare_multi_memes(plan, label_text, profile)
+    outp = _output_path(output_dir, f"out{scene_number}.mp4")
+    encode_clip(outp, scene.make_frame, scene.duration, scene.size, scene.audio, profile=profile)
+    return True
+
+def prepare_single_meme(plan, text, profile=None):
+    """
+    单meme场景：背景、绿幕抠图的meme和文字在内存中合成，meme的缩放比例、位置和音频取自 plan_scene
+    meme素材不存在时返回None
+    """
+    profile = encoder_profile(profile)
+    width = height = canvas_width(profile)
+    if not plan["memes"]:
+        print(f"错误: 表情视频 {catalog.meme_path(plan['meme'])} 不存在")
+        return None
+    if plan["place"] not in catalog.backgrounds:
+        print(f"警告: 背景图片 backgrounds/{plan['place']}.jpg 不存在，使用默认背景")
+
+    # 静态底图：黑色画布 + 顶部对齐的背景图
+    base = np.zeros((height, width, 3), dtype=np.uint8)
+    bg = _load_background(plan["background"], width, profile["fast_decode"])
+    bh = min(height, bg.shape[0])
+    base[:bh] = bg[:bh, :, :3]
+
+    # 文字层在meme之上，只渲染一次
+    text_img = render_text_image(text, width=scaled(1000, profile), fontsize=scaled(60, profile))
+    text_rgb = np.ascontiguousarray(text_img[:, :, :3])
+    text_alpha = np.ascontiguousarray(text_img[:, :, 3])
+    text_x = (width - text_rgb.shape[1]) // 2
+
+    # meme与画面同高，居中放置
+    duration = plan["duration"]
+    planned = plan["memes"][0]
+    meme = meme_cache.get(planned["name"], planned["scale"], duration, profile["fps"], profile["fast_decode"])
+    meme_x, meme_y = planned["xy"][0] + meme.x0, planned["xy"][1] + meme.y0
+
+    compositor = FrameCompositor()
+    out_frame = np.empty_like(base)
+    def make_frame(t):
+        layers = [(meme.get_frame(t), meme.get_alpha(t), meme_x, meme_y),
+                  (text_rgb, text_alpha, text_x, scaled(50, profile))]
+        return compositor.composite(base, layers, out=out_frame)
+
+    audio_file = planned["audio"]
+    if not audio_file:
+        print(f"警告: 音频文件 meme_audio/{planned['name']}.mp3 不存在，生成无音频视频")
+    return SceneFrames(make_frame, duration, (width, height), [audio_file] if audio_file else [])
+
+def compose_single_meme(text, place, num, duration, emo, output_dir=None, profile=None, plan=None):
+    """
+    单meme场景的一次性渲染：背景、绿幕抠图的meme、文字和音频在内存中合成，
+    只编码一次，替代 BgVideo → AddMeme → add_audio_to_video 三次编码的流程
+    """
+    if plan is None:
+        plan = plan_scene({"backgrounds": place, "meme": emo, "duration": duration}, profile=profile)
+    scene = prepare_single_meme(plan, text, profile)
+    if scene is None:
+        return False
+    output_video_path = _output_path(output_dir, f"out{num}.mp4")
+    encode_clip(output_video_path, scene.make_frame, scene.duration, scene.size, scene.audio, profile=profile)
+    print(f"已生成表情视频: out{num}.mp4")
     return True
 
 def BgVideo(text, place, num, duration):
+    from moviepy.editor import ColorClip, ImageClip, CompositeVideoClip
     # 创建一个空白视频，时长为指定duration，分辨率为1080x1080
     width, height = 1080, 1080
     blank_clip = ColorClip((width, height), color=(0, 0, 0), duration=duration)
 
     # 在指定时间点添加图片
-    image_path = f"backgrounds/{place}.jpg"
-    if not os.path.exists(image_path):
-        print(f"警告: 背景图片 {image_path} 不存在，使用默认背景")
-        image_path = f"backgrounds/home.jpg"  # 使用默认背景
+    image_path = catalog.background_path(place)
+    if place not in catalog.backgrounds:
+        print(f"警告: 背景图片 backgrounds/{place}.jpg 不存在，使用默认背景")
     
-    image_clip = ImageClip(image_path).resize(width=1080)
+    image_clip = ImageClip(_load_background(image_path, 1080))
     image_clip = image_clip.set_position(('center', 'top')).set_start(0).set_end(duration)
 
     # 使用PIL创建透明背景文字片段
@@ -253,7 +386,7 @@ def BgVideo(text, place, num, duration):
     final_clip = CompositeVideoClip([blank_clip, image_clip, txt_clip])
 
     # 保存最终视频
-    final_clip.write_videofile(f'{output_folder}/backgrounds{num}.mp4', codec='libx264', fps=24, verbose=False, logger=None)
+    final_clip.write_videofile(_output_path(None, f'backgrounds{num}.mp4'), codec='libx264', fps=24, verbose=False, logger=None)
     print(f"已生成背景视频: backgrounds{num}.mp4")
 
 def chroma_key_composite(green_frame, bg_frame):
@@ -294,12 +427,75 @@ def chroma_key_paste(green_frame, bg_frame, x, y):
     bg[y:y+h, x:x+w, :] = composite_region
     return bg.astype('uint8')
 
+def _clamp_xy(x, y, w, h, W, H):
+    """把粘贴位置限制在画面内，与 chroma_key_paste 的处理一致"""
+    x = int(max(0, min(W - w, x)))
+    y = int(max(0, min(H - h, y)))
+    return x, y
+
+class FrameCompositor:
+    """
+    单帧多图层合成器
+    在原地把各图层混合进背景帧的ROI，使用uint16定点运算和按尺寸预分配的缓冲区，
+    每帧不再产生整帧大小的临时数组
+    """
+    def __init__(self):
+        self._scratch = {}
+
+    def _buffers(self, h, w):
+        bufs = self._scratch.get((h, w))
+        if bufs is None:
+            bufs = (np.empty((h, w, 3), dtype=np.uint16),
+                    np.empty((h, w, 3), dtype=np.uint16),
+                    np.empty((h, w, 3), dtype=np.uint16))
+            self._scratch[(h, w)] = bufs
+        return bufs
+
+    def paste(self, bg_frame, frame, alpha, x, y):
+        """result = (frame*a + bg*(255-a)) / 255，四舍五入，直接写回bg_frame"""
+        H, W = bg_frame.shape[0], bg_frame.shape[1]
+        if frame.shape[0] > H or frame.shape[1] > W:
+            frame, alpha = frame[:H, :W], alpha[:H, :W]
+        h, w = frame.shape[0], frame.shape[1]
+        x, y = _clamp_xy(x, y, w, h, W, H)
+        region = bg_frame[y:y+h, x:x+w, :]
+        acc, tmp, a = self._buffers(h, w)
+        # 逐通道填充alpha，比 (h, w, 1) 广播的混合类型运算快得多
+        for c in range(3):
+            a[:, :, c] = alpha
+        np.multiply(frame, a, out=acc)
+        np.subtract(255, a, out=a)
+        np.multiply(region, a, out=tmp)
+        np.add(acc, tmp, out=acc)
+        # (v + 128 + ((v + 128) >> 8)) >> 8 等价于 round(v / 255)
+        np.add(acc, 128, out=acc)
+        np.right_shift(acc, 8, out=tmp)
+        np.add(acc, tmp, out=acc)
+        np.right_shift(acc, 8, out=acc)
+        np.copyto(region, acc, casting='unsafe')
+        return bg_frame
+
+    def composite(self, bg_frame, layers, out=None):
+        """
+        一次合成一帧的所有图层
+        layers: [(frame, alpha, x, y), ...]，按顺序从下往上叠加
+        out: 可选的输出缓冲区，传入时先把背景复制进去，避免每帧分配新数组
+        """
+        if out is None:
+            out = bg_frame.copy()
+        else:
+            np.copyto(out, bg_frame)
+        for frame, alpha, x, y in layers:
+            self.paste(out, frame, alpha, x, y)
+        return out
+
 def AddMeme(emo, num, duration):
     """使用MoviePy实现绿幕抠图，并确保文字在最上层"""
+    from moviepy.editor import VideoFileClip, VideoClip
     try:
-        green_screen_video_path = f'meme/{emo}.mp4'
-        replacement_video_path = f'{output_folder}/backgrounds{num}.mp4'
-        output_video_path = f'{output_folder}/{num}.mp4'
+        green_screen_video_path = catalog.meme_path(emo)
+        replacement_video_path = _output_path(None, f'backgrounds{num}.mp4')
+        output_video_path = _output_path(None, f'{num}.mp4')
         
         # 检查文件是否存在
         if not os.path.exists(green_screen_video_path):
@@ -422,28 +618,101 @@ def AddNewline(text):
     else:
         return result
 
-def concatenate_videos(folder_path, video_names, output_file):
-    video_clips = []
+def probe_stream_params(video_path):
+    """
+    读取视频文件各个流的编码参数（编码器、像素格式、分辨率、帧率、时间基、采样率等），
+    忽略码率这类每个片段都不同的字段；无法读取时返回None
+    """
+    proc = subprocess.run([ffmpeg_binary(), "-hide_banner", "-i", video_path],
+                          capture_output=True, text=True, encoding="utf-8", errors="replace")
+    params = []
+    for line in proc.stderr.splitlines():
+        m = re.match(r"\s*Stream #\d+:\d+.*?: (Video|Audio): (.*)", line)
+        if not m:
+            continue
+        kind, desc = m.groups()
+        desc = desc.replace("(default)", "")
+        # 按不在括号内的逗号切分，如 "yuv420p(tv, bt709)" 保持为一个字段
+        fields = [f.strip() for f in re.split(r",(?![^(]*\))", desc)]
+        fields = [f for f in fields if f and "kb/s" not in f]
+        params.append((kind, tuple(fields)))
+    return tuple(params) or None
+
+def _concatenate_stream_copy(video_paths, output_file):
+    """使用 ffmpeg concat demuxer 直接拷贝码流拼接，不重新编码"""
+    list_file = output_file + ".concat.txt"
+    try:
+        with open(list_file, "w", encoding="utf-8") as f:
+            for path in video_paths:
+                escaped = os.path.abspath(path).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        proc = subprocess.run([ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", "error",
+                               "-f", "concat", "-safe", "0", "-i", list_file,
+                               "-c", "copy", "-movflags", "+faststart", output_file],
+                              capture_output=True, text=True, encoding="utf-8", errors="replace")
+    finally:
+        if os.path.exists(list_file):
+            os.remove(list_file)
+    if proc.returncode != 0:
+        print(f"警告: 码流拷贝拼接失败: {proc.stderr.strip()}")
+        return False
+    return True
+
+def concatenate_videos(folder_path, video_names, output_file, mode="auto"):
+    """
+    合并视频片段
+    mode: "auto" 所有片段编码参数一致时直接拷贝码流拼接，否则重新编码；
+          "copy" 只尝试码流拷贝；"reencode" 总是解码后重新编码
+    """
+    video_paths = []
     for video_name in video_names:
         video_path = os.path.join(folder_path, video_name)
         if os.path.exists(video_path):
-            try:
-                video_clip = VideoFileClip(video_path)
-                video_clips.append(video_clip)
-            except Exception as e:
-                print(f"警告: 无法加载视频文件 {video_path}: {e}")
+            video_paths.append(video_path)
         else:
             print(f"警告: 视频文件 {video_path} 不存在，跳过")
 
+    if not video_paths:
+        print("错误: 没有可用的视频片段进行合并")
+        return False
+
+    if mode in ("auto", "copy"):
+        params = [probe_stream_params(p) for p in video_paths]
+        if params[0] is not None and all(p == params[0] for p in params):
+            if _concatenate_stream_copy(video_paths, output_file):
+                print(f"已生成最终视频(码流拷贝): {output_file}")
+                return True
+        else:
+            print("提示: 视频片段编码参数不一致，改为重新编码合并")
+        if mode == "copy":
+            return False
+    return _concatenate_reencode(video_paths, output_file)
+
+def _concatenate_reencode(video_paths, output_file):
+    from moviepy.video.io.VideoFileClip import VideoFileClip
+    from moviepy.video.compositing.concatenate import concatenate_videoclips
+    video_clips = []
+    for video_path in video_paths:
+        try:
+            video_clip = VideoFileClip(video_path)
+            video_clips.append(video_clip)
+        except Exception as e:
+            print(f"警告: 无法加载视频文件 {video_path}: {e}")
+
     if video_clips:
         try:
             final_clip = concatenate_videoclips(video_clips)
             final_clip.write_videofile(output_file, codec='libx264', audio_codec='aac', verbose=False, logger=None)
             print(f"已生成最终视频: {output_file}")
+            return True
         except Exception as e:
             print(f"视频合并错误: {e}")
+        finally:
+            for clip in video_clips:
+                clip.close()
     else:
         print("错误: 没有可用的视频片段进行合并")
+    return False
 
 def add_audio_to_video(video_file, audio_file, output_file):
     if not os.path.exists(video_file):
@@ -456,6 +725,8 @@ def add_audio_to_video(video_file, audio_file, output_file):
         return True
     
     try:
+        from moviepy.video.io.VideoFileClip import VideoFileClip
+        from moviepy.audio.io.AudioFileClip import AudioFileClip
         video = VideoFileClip(video_file)
         audio = AudioFileClip(audio_file)
         
@@ -475,21 +746,22 @@ def add_audio_to_video(video_file, audio_file, output_file):
         print(f"添加音频错误: {e}")
         return False
 
-def cleanup_intermediate_files(scene_numbers):
+def cleanup_intermediate_files(scene_numbers, output_dir=None):
     """清理中间生成的多余视频文件"""
+    output_dir = output_dir or output_folder
     print("\n清理中间文件...")
     files_to_delete = []
     
     for scene_number in scene_numbers:
-        bg_video = f"{output_folder}/backgrounds{scene_number}.mp4"
+        bg_video = os.path.join(output_dir, f"backgrounds{scene_number}.mp4")
         if os.path.exists(bg_video):
             files_to_delete.append(bg_video)
         
-        video_file = f"{output_folder}/{scene_number}.mp4"
+        video_file = os.path.join(output_dir, f"{scene_number}.mp4")
         if os.path.exists(video_file):
             files_to_delete.append(video_file)
         
-        out_video = f"{output_folder}/out{scene_number}.mp4"
+        out_video = os.path.join(output_dir, f"out{scene_number}.mp4")
         if os.path.exists(out_video):
             files_to_delete.append(out_video)
     
@@ -502,8 +774,435 @@ def cleanup_intermediate_files(scene_numbers):
     
     print(f"清理完成，共删除 {len(files_to_delete)} 个中间文件")
 
-def process_jsonl_story(jsonl_file):
-    """处理JSONL文件并生成视频"""
+def scene_signature(scene, profile=None):
+    """
+    场景的规范化描述以及渲染会用到的素材文件，用作场景片段缓存的键
+    只包含影响画面和声音的字段，不包含场景编号
+    """
+    place = scene.get("backgrounds", "home")
+    text = scene.get("text", "") or scene.get("label", "")
+    duration = scene.get("duration", 3)
+    bg = catalog.background_path(place)
+    files = [bg]
+    memes = scene.get("memes")
+    if isinstance(memes, list) and memes:
+        desc_memes = []
+        for m in memes:
+            name = m.get("name") or ""
+            lines = _meme_lines(m)
+            desc_memes.append({"name": name, "d_name": m.get("d_name") or name,
+                               "lines": str(lines), "position": int(m.get("position", 1))})
+            files.append(catalog.meme_path(name))
+            if lines:
+                files.append(get_audio_file(name))
+        desc = {"label": AddNewline(text), "memes": desc_memes,
+                "duration": round(compute_scene_duration(memes, duration), 3)}
+    else:
+        emo = scene.get("meme", "其他")
+        files += [catalog.meme_path(emo), get_audio_file(emo)]
+        desc = {"text": AddNewline(text), "meme": emo, "duration": duration}
+    desc["background"] = os.path.basename(bg)
+    # 不同配置（分辨率、帧率、编码参数）的输出不能互相替代
+    desc["encoder"] = {k: v for k, v in encoder_profile(profile).items() if k != "name"}
+    return desc, files
+
+def plan_scene(scene, index=0, profile=None):
+    """
+    只根据素材索引规划场景：时长、画布尺寸以及每个meme的缩放比例、尺寸、位置和音频，不打开任何解码器
+    渲染时直接使用这里的结果（prepare_multi_memes / prepare_single_meme），meme的布局规则只在这里
+    素材不存在的meme不在 plan["memes"] 中
+    """
+    profile = encoder_profile(profile)
+    cw = canvas_width(profile)
+    place = scene.get("backgrounds", "home")
+    bw, bh = asset_index.background_size(place)
+    plan = {"scene_number": scene.get("scene_number", index + 1), "place": place,
+            "background": catalog.background_path(place), "memes": []}
+    memes = scene.get("memes")
+    if isinstance(memes, list) and memes:
+        plan["duration"] = compute_scene_duration(memes, scene.get("duration", 3))
+        canvas_w, canvas_h = cw, int(bh * cw / bw)
+        scale, margin = MEME_SCALE * profile["scale"], scaled(80, profile)
+    else:
+        # 单meme场景
+        plan["meme"] = scene.get("meme", "其他")
+        memes = [{"name": plan["meme"], "position": 0}]
+        plan["duration"] = scene.get("duration", 3)
+        canvas_w, canvas_h = cw, cw
+        scale, margin = None, 0
+    plan["size"] = (canvas_w, canvas_h)
+    for m in memes:
+        name = m.get("name")
+        info = asset_index.meme(name) if name else None
+        if info is None:
+            continue
+        nw, nh = info["size"]
+        s = scale if scale is not None else canvas_h / nh
+        w, h = int(nw * s), int(nh * s)
+        pos = int(m.get("position", 1))
+        if scale is None:
+            # 单meme场景：与画面同高，水平居中，总是播放音频
+            x, y = (canvas_w - w) // 2, 0
+            speaking = True
+        else:
+            x, y = _meme_xy(pos, w, h, canvas_w, canvas_h, margin, scaled(140, profile))
+            speaking = bool(_meme_lines(m))
+        plan["memes"].append({"name": name, "d_name": m.get("d_name") or name, "lines": _meme_lines(m),
+                              "position": pos, "scale": s, "size": (w, h), "xy": (x, y),
+                              "animated": speaking, "audio": get_audio_file(name) if speaking else None,
+                              "audio_duration": asset_index.audio_duration(name) if speaking else None})
+    return plan
+
+def plan_story(story, profile=None):
+    """在渲染之前规划整个故事，并把新读取的素材元数据写回索引，供渲染进程直接使用"""
+    plans = []
+    for i, scene in enumerate(story):
+        try:
+            plans.append(plan_scene(scene, i, profile))
+        except Exception as e:
+            # 渲染该场景时会再次规划并报告错误，不影响其他场景
+            print(f"警告: 场景 {scene.get('scene_number', i + 1)} 规划失败: {e}")
+            plans.append(None)
+    asset_index.save()
+    total = sum(p["duration"] for p in plans if p)
+    print(f"故事规划: {len(plans)} 个场景，共 {total:.1f} 秒")
+    return plans
+
+def render_scene(scene, index=0, output_dir=None, profile=None, plan=None):
+    """
+    渲染单个场景，返回生成的视频文件名；失败时抛出异常
+    相同内容的场景直接从场景片段缓存中取出，不再重新渲染
+    profile: 渲染配置的名字或 encoder.encoder_profile 的结果，默认读取环境变量 RENDER_PROFILE
+    plan: plan_scene 的结果（通常在主进程中规划好），为空时在这里规划
+    """
+    profile = encoder_profile(profile)
+    scene_number = scene.get("scene_number", index + 1)
+    place = scene.get("backgrounds", "home")
+    text = scene.get("text", "") or scene.get("label", "")
+    emo = scene.get("meme", "其他")
+    duration = scene.get("duration", 3)
+    video_name = f"out{scene_number}.mp4"
+    output_path = _output_path(output_dir, video_name)
+
+    cache_key = None
+    if scene_cache.enabled:
+        cache_key = scene_cache.key(*scene_signature(scene, profile))
+        if scene_cache.get(cache_key, output_path):
+            print(f"\n场景 {scene_number} 命中缓存，跳过渲染")
+            return video_name
+
+    print(f"\n处理场景 {scene_number}: {place} - {emo} - {duration}秒")
+
+    processed_text = AddNewline(text)
+    print(f"文本内容: {processed_text}")
+
+    if plan is None:
+        plan = plan_scene(scene, index, profile)
+    memes = scene.get("memes")
+    if isinstance(memes, list) and memes:
+        compose_multi_memes(place, scene_number, processed_text, memes, plan["duration"], output_dir=output_dir,
+                            profile=profile, plan=plan)
+    else:
+        if not compose_single_meme(processed_text, place, scene_number, duration, emo, output_dir=output_dir,
+                                   profile=profile, plan=plan):
+            raise RuntimeError(f"表情视频 {emo} 合成失败")
+    if cache_key is not None:
+        scene_cache.put(cache_key, output_path)
+    return video_name
+
+def prepare_scene(scene, index=0, profile=None, plan=None):
+    """准备单个场景的画面生成函数和音频，不编码；素材缺失时抛出异常"""
+    if plan is None:
+        plan = plan_scene(scene, index, profile)
+    text = AddNewline(scene.get("text", "") or scene.get("label", ""))
+    memes = scene.get("memes")
+    if isinstance(memes, list) and memes:
+        return prepare_multi_memes(plan, text, profile)
+    frames = prepare_single_meme(plan, text, profile)
+    if frames is None:
+        raise RuntimeError(f"表情视频 {plan['meme']} 合成失败")
+    return frames
+
+def _fit_frame(make_frame, size, target):
+    """把画面居中裁剪或补黑边到 target 尺寸"""
+    (w, h), (tw, th) = size, target
+    out = np.zeros((th, tw, 3), dtype=np.uint8)
+    sy, dy = max(0, (h - th) // 2), max(0, (th - h) // 2)
+    sx, dx = max(0, (w - tw) // 2), max(0, (tw - w) // 2)
+    ch, cw = min(h, th), min(w, tw)
+
+    def fitted(t):
+        out[dy:dy + ch, dx:dx + cw] = make_frame(t)[sy:sy + ch, sx:sx + cw]
+        return out
+    return fitted
+
+def _encode_scene_task(story_encoder, scene, index, profile=None, plan=None):
+    """
+    整个故事只编码一次时的渲染任务：合成场景画面并写入共享的 StoryEncoder
+    素材缺失等准备阶段的错误只跳过该场景，返回 (场景编号或None, 错误信息)；编码器出错时抛出异常
+    """
+    scene_number = scene.get("scene_number", index + 1)
+    print(f"\n处理场景 {scene_number}")
+    try:
+        frames = prepare_scene(scene, index, profile, plan)
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+    make_frame = frames.make_frame
+    if tuple(frames.size) != tuple(story_encoder.size):
+        make_frame = _fit_frame(make_frame, frames.size, story_encoder.size)
+    story_encoder.add_scene(make_frame, frames.duration, frames.audio)
+    return scene_number, None
+
+def render_story_single_encode(scenes, output_dir=None, progress=None, profile=None, plans=None):
+    """
+    整个故事只启动一个ffmpeg进程：场景按顺序合成后写入同一个 StoryEncoder，
+    不生成中间片段，也不需要合并；画面尺寸不是正方形的场景居中裁剪或补黑边
+    scenes 可以是列表，也可以是逐个产出场景的可迭代对象（流式生成脚本时边接收边编码）
+    素材缺失的场景跳过；编码出错或接收场景出错时放弃整个故事；不使用场景片段缓存
+    """
+    profile = encoder_profile(profile)
+    output_dir = output_dir or output_folder
+    output_file = _output_path(output_dir, "Final_Story.mp4")
+    size = (canvas_width(profile), canvas_width(profile))
+    story_encoder = StoryEncoder(output_file, size, profile=profile)
+    total = len(scenes) if hasattr(scenes, "__len__") else None
+    renderer = SceneRenderer(1, output_dir, progress, total=total, profile=profile, story_encoder=story_encoder)
+    try:
+        for i, scene in enumerate(scenes):
+            renderer.submit(scene, plans[i] if plans else None)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        print(f"接收场景时出错: {e}")
+        renderer.cancel()
+        story_encoder.abort()
+        return False
+    results = renderer.results()
+    failed = [(n, err) for n, done, err in results if done is None]
+    for n, err in failed:
+        print(f"场景 {n} 渲染失败: {err}，已跳过")
+    if len(failed) == len(results):
+        story_encoder.abort()
+        print("错误: 没有成功生成任何场景")
+        return False
+    try:
+        story_encoder.finish()
+    except Exception as e:
+        story_encoder.abort()
+        print(f"错误: 视频编码失败: {e}")
+        return False
+    print(f"\n视频生成完成！最终视频: {output_file}")
+    return True
+
+def single_encode_enabled(workers):
+    """
+    逐个渲染时是否整个故事只编码一次
+    只编码一次不生成场景片段，无法读写场景片段缓存，所以默认只在缓存关闭（SCENE_CACHE_BYTES=0）时使用；
+    STORY_SINGLE_ENCODE=1 强制使用（不走缓存），STORY_SINGLE_ENCODE=0 强制逐场景编码片段再合并
+    """
+    if workers > 1:
+        return False
+    setting = os.environ.get('STORY_SINGLE_ENCODE', '')
+    if setting:
+        return setting != '0'
+    return not scene_cache.enabled
+
+def publish_story_assets(store, story, profile=None, workers=1, plans=None):
+    """
+    把故事要用到的背景和meme帧各解码一次，写入共享内存，供渲染进程映射
+    帧图集已经包含的meme和命中场景缓存的场景不再发布；
+    解码在线程池中进行（ffmpeg解码和PIL缩放时不持有GIL）
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    profile = encoder_profile(profile)
+    cw, fps, fast = canvas_width(profile), profile["fps"], profile["fast_decode"]
+    backgrounds = set()
+    memes = {}
+    for i, scene in enumerate(story):
+        if scene_cache.enabled and scene_cache.contains(scene_cache.key(*scene_signature(scene, profile))):
+            continue
+        plan = plans[i] if plans else plan_scene(scene, i, profile)
+        if plan is None:
+            # 规划失败的场景由渲染任务报告错误
+            continue
+        backgrounds.add(plan["background"])
+        for m in plan["memes"]:
+            # 与 MemeLayer / prepare_single_meme 使用同一份规划中的缩放比例和时长
+            key = (m["name"], m["scale"])
+            memes[key] = max(memes.get(key, 0), plan["duration"] if m["animated"] else 0)
+
+    # 单个素材发布失败只打印警告，该素材由工作进程自行解码
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        list(pool.map(lambda path: store.publish_background(path, cw, fast), backgrounds))
+        list(pool.map(lambda item: store.publish_meme(item[0][0], item[0][1], fps, fast, item[1]), memes.items()))
+    registry = store.registry()
+    print(f"共享素材: {len(registry['backgrounds'])} 个背景，{len(registry['memes'])} 个meme，"
+          f"共 {store.nbytes / 1024 / 1024:.0f} MB")
+
+def _process_context():
+    """渲染进程池的启动方式：支持时使用 forkserver，否则使用 spawn"""
+    import multiprocessing
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+def _render_scene_task(scene, index, output_dir=None, profile=None, plan=None):
+    """进程池任务：捕获异常，按场景返回 (视频文件名, 错误信息)"""
+    try:
+        return render_scene(scene, index, output_dir, profile, plan), None
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return None, f"{type(e).__name__}: {e}"
+
+class SceneRenderer:
+    """
+    可以边接收场景边渲染：submit 立即返回，场景在后台渲染
+    workers > 1 时使用进程池并行渲染，否则在一个后台线程中逐个渲染
+    registry: 可选，SharedAssetStore.registry()，工作进程启动时映射其中的共享素材
+    story_encoder: 可选，StoryEncoder；不为空时在后台线程中按提交顺序把场景写入这个编码器，不生成片段
+    progress: 可选回调，每个场景完成后以 dict 形式报告
+              {"scene": 场景编号, "status": "done"/"failed", "error": ..., "done": 已完成数, "total": 总数}
+              流式提交时场景总数未知，total 为已提交的场景数
+    """
+    def __init__(self, workers=1, output_dir=None, progress=None, total=None, profile=None, registry=None,
+                 story_encoder=None):
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        self.output_dir = output_dir
+        # 在主进程中解析一次，工作进程使用同一份配置
+        self.profile = encoder_profile(profile)
+        self.progress = progress
+        self.total = total
+        self.story_encoder = story_encoder
+        self.scene_numbers = []
+        self.outcomes = []
+        self.futures = []
+        self._lock = threading.Lock()
+        if workers > 1 and story_encoder is None:
+            # 不使用fork：任务线程（JobManager）并发运行时，fork出的子进程可能继承其他线程持有的锁
+            # （素材缓存、素材索引、stdout等），第一次用到时就会死锁
+            kwargs = {"max_workers": workers, "mp_context": _process_context()}
+            if registry:
+                kwargs.update(initializer=shared_assets.attach, initargs=(registry,))
+            self.pool = ProcessPoolExecutor(**kwargs)
+        else:
+            self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
+
+    def submit(self, scene, plan=None):
+        """plan 为空时在主进程中规划场景（并记录新读取的素材元数据），规划失败的场景交给渲染任务报告错误"""
+        with self._lock:
+            i = len(self.scene_numbers)
+            self.scene_numbers.append(scene.get("scene_number", i + 1))
+            self.outcomes.append(None)
+        if plan is None:
+            try:
+                plan = plan_scene(scene, i, self.profile)
+            except Exception:
+                plan = None
+        if self.story_encoder is not None:
+            future = self.pool.submit(_encode_scene_task, self.story_encoder, scene, i, self.profile, plan)
+        else:
+            future = self.pool.submit(_render_scene_task, scene, i, self.output_dir, self.profile, plan)
+        future.add_done_callback(lambda f: self._finish(i, f))
+        self.futures.append(future)
+
+    def _finish(self, i, future):
+        try:
+            outcome = future.result()
+        except Exception as e:
+            # 工作进程崩溃等无法在任务内部捕获的错误
+            outcome = (None, f"{type(e).__name__}: {e}")
+        with self._lock:
+            self.outcomes[i] = outcome
+            info = {"scene": self.scene_numbers[i], "status": "done" if outcome[0] is not None else "failed",
+                    "error": outcome[1], "done": sum(o is not None for o in self.outcomes),
+                    "total": self.total or len(self.scene_numbers)}
+        if self.progress is not None:
+            self.progress(info)
+
+    def results(self):
+        """
+        等待所有已提交的场景，返回按提交顺序排列的 [(scene_number, 视频文件名或None, 错误信息或None), ...]
+        使用 story_encoder 时第二项为成功写入编码器的场景编号
+        """
+        from concurrent.futures import wait
+        wait(self.futures)
+        self.pool.shutdown()
+        asset_index.save()
+        with self._lock:
+            return [(n, name, err) for n, (name, err) in zip(self.scene_numbers, self.outcomes)]
+
+    def cancel(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+def render_scenes(story, workers=1, output_dir=None, progress=None, profile=None, plans=None):
+    """
+    渲染所有场景，workers > 1 时使用进程池并行渲染，progress 参见 SceneRenderer
+    plans: 可选，plan_story 的结果，按场景顺序传给渲染任务
+    返回按场景顺序排列的 [(scene_number, 视频文件名或None, 错误信息或None), ...]
+    """
+    workers = max(1, min(workers, len(story)))
+    store = None
+    try:
+        if workers > 1:
+            print(f"使用 {workers} 个进程并行渲染 {len(story)} 个场景")
+            if shared_assets.ENABLED:
+                # 素材只在主进程解码一次，工作进程共享同一份内存
+                store = SharedAssetStore()
+                try:
+                    publish_story_assets(store, story, profile, workers, plans)
+                except Exception as e:
+                    print(f"警告: 发布共享素材失败，各进程单独解码素材: {e}")
+                    store.close()
+                    store = None
+        renderer = SceneRenderer(workers, output_dir, progress, total=len(story), profile=profile,
+                                 registry=store.registry() if store else None)
+        for i, scene in enumerate(story):
+            renderer.submit(scene, plans[i] if plans else None)
+        return renderer.results()
+    finally:
+        if store is not None:
+            store.close()
+
+def finish_story(results, output_dir):
+    """报告失败的场景，把成功的片段合并为 Final_Story.mp4 并清理中间文件"""
+    scene_numbers = [n for n, _, _ in results]
+    video_names = [name for _, name, _ in results if name]
+    failed = [(n, err) for n, name, err in results if not name]
+    for n, err in failed:
+        print(f"场景 {n} 渲染失败: {err}")
+    if failed:
+        print(f"共 {len(failed)} 个场景渲染失败，已跳过")
+    
+    if video_names:
+        output_file = os.path.join(output_dir, "Final_Story.mp4")
+        ok = concatenate_videos(output_dir, video_names, output_file)
+        cleanup_intermediate_files(scene_numbers, output_dir)
+        if not ok:
+            print("错误: 视频片段合并失败")
+            return False
+        print(f"\n视频生成完成！最终视频: {output_file}")
+        return True
+    else:
+        print("错误: 没有成功生成任何视频片段")
+        return False
+
+def process_jsonl_story(jsonl_file, workers=None, output_dir=None, progress=None, profile=None):
+    """
+    处理JSONL文件并生成视频
+    workers: 并行渲染场景的进程数，默认读取环境变量 RENDER_WORKERS（未设置时为1，即逐个渲染）；
+             逐个渲染时默认逐场景编码片段（命中场景片段缓存的直接复用）再合并，
+             缓存关闭或 STORY_SINGLE_ENCODE=1 时整个故事只启动一个ffmpeg进程编码，参见 single_encode_enabled；
+             多进程时背景和meme帧由主进程解码一次后放在共享内存中（SHARED_ASSETS=0 时关闭）
+    output_dir: 片段和最终视频的输出目录，默认为 results
+    progress: 可选回调，参见 SceneRenderer
+    profile: "final" 正式输出，"draft" 低分辨率低帧率的快速预览；默认读取环境变量 RENDER_PROFILE，参见 encoder
+    """
+    if workers is None:
+        workers = int(os.environ.get('RENDER_WORKERS', 1))
+    profile = encoder_profile(profile)
+    output_dir = output_dir or output_folder
+    os.makedirs(output_dir, exist_ok=True)
     
     story = []
     with open(jsonl_file, 'r', encoding='utf-8') as f:
@@ -516,49 +1215,39 @@ def process_jsonl_story(jsonl_file):
                     print(f"JSON解析错误: {e}，跳过该行: {line}")
     
     print(f"成功读取 {len(story)} 个场景")
+    plans = plan_story(story, profile)
+    if single_encode_enabled(workers):
+        return render_story_single_encode(story, output_dir, progress, profile, plans)
     
-    video_names = []
-    scene_numbers = []
-    
-    for i, scene in enumerate(story):
-        scene_number = scene.get("scene_number", i + 1)
-        place = scene.get("backgrounds", "home")
-        text = scene.get("text", "") or scene.get("label", "")
-        emo = scene.get("meme", "其他")
-        duration = scene.get("duration", 3)
-        
-        print(f"\n处理场景 {scene_number}: {place} - {emo} - {duration}秒")
-        
-        scene_numbers.append(scene_number)
-        processed_text = AddNewline(text)
-        print(f"文本内容: {processed_text}")
-        
-        memes = scene.get("memes")
-        if isinstance(memes, list) and memes:
-            d2 = compute_scene_duration(memes, duration)
-            label_text = AddNewline(text)
-            compose_multi_memes(place, scene_number, label_text, memes, d2)
-            video_names.append(f"out{scene_number}.mp4")
-        else:
-            BgVideo(processed_text, place, scene_number, duration)
-            if not AddMeme(emo, scene_number, duration):
-                continue
-            audio_file = f"meme_audio/{emo}.mp3"
-            video_file = f"{output_folder}/{scene_number}.mp4"
-            output_video_file = f"{output_folder}/out{scene_number}.mp4"
-            add_audio_to_video(video_file, audio_file, output_video_file)
-            video_names.append(f"out{scene_number}.mp4")
-    
-    if video_names:
-        folder_path = f"results"
-        output_file = f"results/Final_Story.mp4"
-        concatenate_videos(folder_path, video_names, output_file)
-        cleanup_intermediate_files(scene_numbers)
-        print("\n视频生成完成！最终视频: Final_Story.mp4")
-        return True
-    else:
-        print("错误: 没有成功生成任何视频片段")
+    return finish_story(render_scenes(story, workers, output_dir, progress, profile, plans), output_dir)
+
+def process_story_stream(scenes, workers=None, output_dir=None, progress=None, profile=None):
+    """
+    流式生成视频：scenes 为逐个产出场景的可迭代对象（如 script.get_script_stream），
+    每收到一个场景立即开始渲染，使LLM生成与视频编码重叠进行
+    迭代过程中出错（如LLM连接中断）时取消未开始的场景并返回False
+    只编码一次时所有场景依次写入同一个编码器，参见 single_encode_enabled、render_story_single_encode
+    """
+    if workers is None:
+        workers = int(os.environ.get('RENDER_WORKERS', 1))
+    output_dir = output_dir or output_folder
+    os.makedirs(output_dir, exist_ok=True)
+    if single_encode_enabled(workers):
+        return render_story_single_encode(scenes, output_dir, progress, profile)
+
+    renderer = SceneRenderer(max(1, workers), output_dir, progress, profile=profile)
+    try:
+        for scene in scenes:
+            renderer.submit(scene)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        print(f"接收场景时出错: {e}")
+        renderer.cancel()
+        cleanup_intermediate_files(renderer.scene_numbers, output_dir)
         return False
+    print(f"成功接收 {len(renderer.scene_numbers)} 个场景")
+    return finish_story(renderer.results(), output_dir)
 
 # 使用示例
 if __name__ == "__main__":
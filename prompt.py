@@ -1,3 +1,7 @@
+import hashlib
+import threading
+from string import Formatter
+from collections import OrderedDict
 from typing import List, Dict
 
 query2script_prompt="""
@@ -723,27 +727,222 @@ json_check = """
 ]
 再次强调：输出必须是能被解析的json格式
 """
+name_resolve_prompt = """
+下面这些猫meme名字（kind为meme）或场景背景（kind为background）不在素材库中，请根据名字本身以及对应的台词text，为每一个从指定列表中选择一个**最合适的**、**最符合场景的**替换：
+    - meme名字严格从以下列表中选择：{memes}
+    - 场景背景严格从以下列表中选择：{backgrounds}
+例如："鄙夷" → "蔑视"，"锐利" → "威严"，"university" → "school"
+请只返回一个json对象，键为原名字，值为替换后的名字，禁止生成其他冗余的内容，例如：
+{{"鄙夷": "蔑视", "university": "school"}}
+"""
+# 猫meme按情绪/动作分类，名字包含关键词即归入该类（按顺序匹配），都不包含时归入"其他"
+MEME_CATEGORIES = [
+    ("惊讶", ["惊", "目瞪口呆", "不好了", "完啦", "你不要过来"]),
+    ("开心", ["笑", "开心", "愉快", "高兴", "兴奋", "欢呼", "庆祝", "享受", "得意", "得瑟", "胜利", "舞", "悠闲"]),
+    ("可爱", ["可爱", "撒娇", "害羞", "任性", "谄媚", "拜托", "哀求"]),
+    ("生气", ["怒", "生气", "烦躁", "跺脚", "质问", "教训", "嚣张", "威严", "凝视", "大叫"]),
+    ("难过", ["哭", "泣", "委屈", "可怜", "忧郁", "绝望", "崩溃", "痛苦", "无助", "诉苦", "挨打", "面色如土", "头疼", "反胃"]),
+    ("紧张", ["紧张", "焦急", "发抖"]),
+    ("冷淡", ["冷漠", "淡定", "蔑视", "无奈", "呆滞", "痴呆", "白眼", "不想听", "不认真", "对牛弹琴", "无辜", "尴尬", "说不清", "昏"]),
+    ("说话", ["说话", "滔滔不绝", "看看", "装逼", "炫耀", "高手"]),
+    ("日常", ["吃", "饿", "工作", "键盘", "车", "方向盘", "摩托", "跑", "哈欠", "瞌睡", "出发", "努力", "拳击", "起势", "勇敢"]),
+]
+
+def group_memes(names, categories=MEME_CATEGORIES):
+    """按 MEME_CATEGORIES 分组，返回 {类别: [名字, ...]}"""
+    groups = {c: [] for c, _ in categories}
+    groups["其他"] = []
+    for n in names:
+        for c, keywords in categories:
+            if any(k in n for k in keywords):
+                groups[c].append(n)
+                break
+        else:
+            groups["其他"].append(n)
+    return {c: v for c, v in groups.items() if v}
+
+
+def render_catalog(names, grouped=False):
+    """
+    把素材名列表渲染为紧凑文本，替代 Python list 的repr（每个名字省去引号、逗号和空格）
+    grouped=True 时按情绪分类，每类一行
+    数字结尾的同类变体（吃饭、吃饭2）都保留，它们是不同的素材
+    """
+    names = sorted(names)
+    if not grouped:
+        return ",".join(names)
+    return "".join(f"\n{c}：{','.join(v)}" for c, v in group_memes(names).items())
+
+
+def estimate_tokens(text):
+    """
+    粗略估计token数：中文等非ASCII字符按每字1个token，其余按每4个字符1个token
+    仅用于没有 usage 信息时的统计和对比
+    """
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + (len(text) - non_ascii + 3) // 4
+
+
+def estimate_message_tokens(messages):
+    """messages 的估计token数，每条消息额外计4个token的格式开销"""
+    return sum(estimate_tokens(m.get("content") or "") + 4 for m in messages)
+
+
+def _freeze(value):
+    """把变量值转换为可哈希的形式，用作渲染缓存的键"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+class CompiledTemplate:
+    """
+    预编译的模板：只在创建时扫描一次模板字符串，拆分为静态文本段和占位符段，
+    渲染时直接拼接，不再对整个模板（包括大量 {{ }} 转义的示例）重复做 str.format
+    """
+    def __init__(self, template: str):
+        self.template = template
+        self.segments = []
+        formatter = Formatter()
+        for literal, field, spec, conversion in formatter.parse(template):
+            if literal:
+                # parse 会在每个 {{ }} 转义处断开，相邻的静态文本合并为一段
+                if self.segments and self.segments[-1][0] is not None:
+                    literal = self.segments.pop()[0] + literal
+                self.segments.append((literal, None, None, None))
+            if field is not None:
+                self.segments.append((None, field, spec, conversion))
+        self.fields = sorted({f.split(".")[0].split("[")[0] for _, f, _, _ in self.segments if f})
+        # 第一个占位符之前的静态文本
+        self.static_prefix = self.segments[0][0] if self.segments and self.segments[0][0] is not None else ""
+        self._formatter = formatter
+
+    def render(self, **kwargs) -> str:
+        parts = []
+        for literal, field, spec, conversion in self.segments:
+            if literal is not None:
+                parts.append(literal)
+                continue
+            value = self._formatter.get_field(field, (), kwargs)[0]
+            value = self._formatter.convert_field(value, conversion)
+            parts.append(format(value, spec or ""))
+        return "".join(parts)
+
+
 class PromptTemplate:
     """
     通用 Chat 模板类，支持 system 和 user prompt
+    模板在首次使用时编译；system 消息按其变量值缓存，变量不变时直接复用已渲染的文本
     """
-    def __init__(self, system_template: str = "", user_template: str = ""):
+    def __init__(self, system_template: str = "", user_template: str = "", catalogs: Dict[str, bool] = None,
+                 cache_size: int = 8):
         """
         初始化模板
         system_template: system 角色的模板字符串，可为空
         user_template: user 角色的模板字符串，可为空
+        catalogs: 以紧凑格式渲染的素材列表占位符，{占位符: 是否按类别分组}，如 {"memes": True, "backgrounds": False}
+        cache_size: 缓存已渲染 system 消息的数量
         """
         # self.sys_messages=[]
         self.system_template = system_template
         self.user_template = user_template
+        self.catalogs = catalogs or {}
+        self.cache_size = cache_size
+        self.bound = {}
+        self._bound_key = None
+        self._compiled_system = None
+        self._compiled_user = None
+        self._system_cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _render_kwargs(self, kwargs):
+        kwargs = dict(kwargs)
+        for name, grouped in self.catalogs.items():
+            if isinstance(kwargs.get(name), (list, tuple)):
+                kwargs[name] = render_catalog(kwargs[name], grouped)
+        return kwargs
+
+    @property
+    def compiled_system(self) -> CompiledTemplate:
+        if self._compiled_system is None:
+            self._compiled_system = CompiledTemplate(self.system_template)
+        return self._compiled_system
+
+    @property
+    def compiled_user(self) -> CompiledTemplate:
+        if self._compiled_user is None:
+            self._compiled_user = CompiledTemplate(self.user_template)
+        return self._compiled_user
+
+    def prerender(self, **kwargs) -> "PromptTemplate":
+        """
+        绑定 system 模板的变量（如素材列表）并预先渲染，之后 format_messages 不必再传入这些变量
+        """
+        self.bound = dict(kwargs)
+        self._bound_key = None
+        if self.system_template:
+            self._bound_key = self._cache_key(self._system_values({}))
+            self.render_system()
+        return self
+
+    def _system_values(self, kwargs):
+        values = {**self.bound, **kwargs}
+        return {k: values[k] for k in self.compiled_system.fields if k in values}
+
+    @staticmethod
+    def _cache_key(values):
+        try:
+            key = tuple((k, _freeze(values[k])) for k in sorted(values))
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def render_system(self, **kwargs) -> str:
+        """渲染 system 消息；变量值与之前某次相同时直接返回缓存的结果"""
+        compiled = self.compiled_system
+        if self._bound_key is not None and not any(k in kwargs for k in compiled.fields):
+            # 只用到绑定的变量，无需再计算缓存键
+            values, key = None, self._bound_key
+        else:
+            values = self._system_values(kwargs)
+            key = self._cache_key(values)
+        if key is not None:
+            with self._lock:
+                content = self._system_cache.get(key)
+                if content is not None:
+                    self._system_cache.move_to_end(key)
+                    return content
+        if values is None:
+            values = self._system_values(kwargs)
+        content = compiled.render(**self._render_kwargs(values))
+        if key is not None:
+            with self._lock:
+                self._system_cache[key] = content
+                while len(self._system_cache) > self.cache_size:
+                    self._system_cache.popitem(last=False)
+        return content
+
+    def prefix_hash(self, **kwargs) -> str:
+        """
+        已渲染 system 消息的sha256，作为稳定的提示词前缀标识
+        变量不变时哈希不变，可传给支持前缀缓存的服务（如 prompt_cache_key）
+        """
+        return hashlib.sha256(self.render_system(**kwargs).encode("utf-8")).hexdigest()
 
     def set_system_template(self, template: str):
         """更新 system 模板"""
         self.system_template = template
+        self._compiled_system = None
+        with self._lock:
+            self._system_cache.clear()
 
     def set_user_template(self, template: str):
         """更新 user 模板"""
         self.user_template = template
+        self._compiled_user = None
 
     def format_messages(self, **kwargs) -> List[Dict[str, str]]:
         """
@@ -754,9 +953,11 @@ class PromptTemplate:
         messages = []
 
         if self.system_template:
-            messages.append({"role": "system", "content": self.system_template.format(**kwargs)})
+            messages.append({"role": "system", "content": self.render_system(**kwargs)})
         if self.user_template:
-            messages.append({"role": "user", "content": self.user_template.format(**kwargs)})
+            values = {**self.bound, **kwargs}
+            values = self._render_kwargs({k: values[k] for k in self.compiled_user.fields if k in values})
+            messages.append({"role": "user", "content": self.compiled_user.render(**values)})
 
         return messages
 
@@ -0,0 +1,135 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from catalog import catalog
+
+# 渲染结果发生变化（合成方式、编码参数等）时递增，使旧缓存失效
+# 2: 旧版本命中时硬链接到输出文件，之后覆盖输出文件可能已经破坏了缓存中的片段
+RENDER_VERSION = "2"
+
+# 默认放在素材根目录下（与素材索引、帧图集相同），与当前工作目录无关
+DEFAULT_CACHE_DIR = os.environ.get('SCENE_CACHE_DIR', catalog.path("cache", "scenes"))
+# 场景片段缓存的磁盘上限（字节），设为0时关闭缓存
+DEFAULT_CACHE_BYTES = int(os.environ.get('SCENE_CACHE_BYTES', 2 * 1024 * 1024 * 1024))
+
+_file_hashes = {}
+_file_hashes_lock = threading.Lock()
+
+
+def file_digest(path):
+    """素材文件内容的sha256，按 (路径, 大小, 修改时间) 在进程内缓存"""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _file_hashes_lock:
+        digest = _file_hashes.get(key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with _file_hashes_lock:
+            _file_hashes[key] = digest
+    return digest
+
+
+class SceneRenderCache:
+    """
+    按内容寻址的场景片段缓存
+    键为 规范化场景描述 + 所用素材文件哈希 + RENDER_VERSION 的sha256，
+    值为渲染好的mp4；磁盘占用超过上限时按最近使用时间淘汰
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def key(self, description, files=()):
+        payload = {
+            "version": RENDER_VERSION,
+            "scene": description,
+            "assets": {os.path.basename(p): file_digest(p) for p in sorted(set(files)) if p and os.path.exists(p)},
+        }
+        data = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.mp4")
+
+    def get(self, key, dest):
+        """
+        命中时把缓存的片段复制到dest并返回True
+        不使用硬链接：之后在dest上重新编码（ffmpeg -y 原地覆盖）会改写同一个inode，破坏缓存
+        """
+        if not self.enabled:
+            return False
+        path = self._path(key)
+        tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.utime(path)
+            shutil.copyfile(path, tmp)
+            os.replace(tmp, dest)
+        except FileNotFoundError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def contains(self, key):
+        return self.enabled and os.path.exists(self._path(key))
+
+    def put(self, key, src):
+        if not self.enabled or not os.path.exists(src):
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            shutil.copyfile(src, tmp)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"警告: 写入场景缓存失败: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self.evict()
+
+    def evict(self):
+        """删除最久未使用的片段，直到总大小不超过上限"""
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for f in files:
+                if not f.endswith(".mp4"):
+                    continue
+                p = os.path.join(root, f)
+                try:
+                    st = os.stat(p)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, p))
+                total += st.st_size
+        entries.sort()
+        for _, size, p in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+scene_cache = SceneRenderCache()
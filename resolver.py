@@ -0,0 +1,190 @@
+import re
+import threading
+from collections import defaultdict
+
+# 常见的幻觉名字 → 素材库中的名字（取自 json_check 提示词中的示例，并补充了脚本里常见的情绪词）
+# 目标不在素材库中的条目会被忽略
+MEME_SYNONYMS = {
+    "鄙夷": "蔑视", "不屑": "蔑视", "轻蔑": "蔑视", "鄙视": "蔑视",
+    "淡然": "淡定", "镇定": "淡定", "平静": "淡定", "冷静": "淡定", "从容": "淡定",
+    "嗤笑": "嘲笑", "讥笑": "嘲笑", "冷笑": "坏笑",
+    "打断": "质问", "追问": "质问", "反问": "质问", "怀疑": "质问",
+    "摆手": "无奈", "无语": "无奈", "叹气": "无奈",
+    "锐利": "威严", "严肃": "威严", "严厉": "威严", "强势": "威严",
+    "微笑": "愉快", "满意": "愉快", "欣慰": "愉快",
+    "紧张": "紧张流汗", "心虚": "紧张流汗", "慌张": "焦急", "着急": "焦急",
+    "坚定": "勇敢", "自信": "得意", "骄傲": "得意", "自豪": "得意",
+    "惊恐": "惊吓", "害怕": "瑟瑟发抖", "恐惧": "瑟瑟发抖",
+    "伤心": "哭泣", "难过": "忧郁", "悲伤": "哭泣", "哭": "哭泣",
+    "生气": "愤怒", "发怒": "愤怒", "恼怒": "愤怒", "暴怒": "仰头怒吼",
+    "疑惑": "呆滞", "困惑": "呆滞", "发呆": "呆滞", "懵": "呆滞",
+    "疲惫": "打哈欠", "困": "打瞌睡", "睡觉": "打瞌睡",
+    "讨好": "谄媚", "恭维": "谄媚", "求饶": "哀求", "请求": "拜托",
+    "激动": "兴奋", "惊喜": "兴奋", "哈哈大笑": "大笑", "开怀大笑": "大笑",
+    "说教": "教训", "批评": "教训", "抱怨": "诉苦",
+    "不开心": "忧郁", "不高兴": "烦躁", "不爽": "烦躁", "没劲": "无奈",
+}
+
+BACKGROUND_SYNONYMS = {
+    "university": "school", "college": "school", "campus": "school",
+    "office": "others", "company": "others",
+    "cafe": "restaurant", "canteen": "restaurant", "dining": "restaurant",
+    "mall": "shop", "store": "shop", "supermarket": "shop",
+    "street": "highway", "road": "highway", "city": "others",
+    "bedroom": "home", "livingroom": "home", "house": "home",
+    "sea": "beach", "ocean": "beach", "lake": "river",
+    "train": "station", "subway": "station", "harbor": "port",
+    "laboratory": "lab", "fantasy": "fantacy", "mountain": "Mountain",
+}
+
+# 素材库中的同类变体用数字结尾标记，如 吃饭、吃饭2
+_VARIANT = re.compile(r"\d+$")
+
+# 否定前缀：不开心 和 开心 字面相近但意思相反，模糊匹配时只在否定性相同的名字之间比较，
+# 并且去掉前缀后再计算相似度（不想吃 和 不想听 只共享"不想"，不应匹配）
+NEGATIONS = ("不", "没")
+
+
+def _split_negation(text):
+    """返回 (是否带否定前缀, 去掉前缀后的部分)"""
+    for prefix in NEGATIONS:
+        if text.startswith(prefix) and len(text) > len(prefix):
+            return True, text[len(prefix):]
+    return False, text
+
+
+def _grams(text):
+    """字符一元和二元组，用于中文名字的模糊匹配"""
+    text = text.lower()
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+class NameIndex:
+    """
+    单个素材列表（meme名或背景）的本地解析：
+    精确匹配 → 去掉数字变体 → 同义词表 → 字符n-gram相似度（不跨越否定前缀）
+    """
+    def __init__(self, names, synonyms=None, threshold=0.5):
+        self.names = list(names)
+        self.threshold = threshold
+        self._exact = {n: n for n in self.names}
+        self._lower = {n.lower(): n for n in self.names}
+        self.synonyms = {k: v for k, v in (synonyms or {}).items() if v in self._exact}
+        self._negated = {}
+        self._grams = {}
+        for n in self.names:
+            self._negated[n], stem = _split_negation(n)
+            self._grams[n] = _grams(stem)
+        self._postings = defaultdict(set)
+        for n, grams in self._grams.items():
+            for g in grams:
+                self._postings[g].add(n)
+
+    def resolve(self, name):
+        """返回 (素材名或None, 解析方式)"""
+        name = str(name or "").strip()
+        if not name:
+            return None, "unresolved"
+        if name in self._exact:
+            return name, "exact"
+        if name.lower() in self._lower:
+            return self._lower[name.lower()], "exact"
+        base = _VARIANT.sub("", name)
+        if base and base in self._exact:
+            return base, "variant"
+        for key in (name, name.lower(), base):
+            if key in self.synonyms:
+                return self.synonyms[key], "synonym"
+        match = self.similar(name)
+        if match is not None:
+            return match, "ngram"
+        return None, "unresolved"
+
+    def similar(self, name):
+        """
+        Dice系数最高且不低于阈值的名字；分数相同时选更短的（更通用的）名字
+        只和否定性相同的名字比较，相似度按去掉否定前缀后的部分计算
+        """
+        negated, stem = _split_negation(name)
+        grams = _grams(stem)
+        candidates = set()
+        for g in grams:
+            candidates |= self._postings.get(g, set())
+        best, best_score = None, 0.0
+        for n in candidates:
+            if self._negated[n] != negated:
+                continue
+            other = self._grams[n]
+            score = 2 * len(grams & other) / (len(grams) + len(other))
+            if score > best_score or (score == best_score and best is not None and len(n) < len(best)):
+                best, best_score = n, score
+        return best if best_score >= self.threshold else None
+
+
+class NameResolver:
+    """
+    把LLM生成的 backgrounds 和 memes[].name 对齐到现有素材
+    本地无法解析的名字收集起来交给LLM，并统计各种解析方式的次数和升级到LLM的比例
+    """
+    def __init__(self, meme_names, backgrounds, threshold=0.5):
+        self.memes = NameIndex(meme_names, MEME_SYNONYMS, threshold)
+        self.backgrounds = NameIndex(backgrounds, BACKGROUND_SYNONYMS, threshold)
+        self.counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def _count(self, method):
+        with self._lock:
+            self.counts[method] += 1
+
+    def resolve_scenes(self, scenes):
+        """
+        原地修正能在本地解析的名字
+        返回无法解析的条目 [{"kind": "meme"/"background", "name": 原名, "text": 台词}, ...]（按名字去重）
+        """
+        unresolved = {}
+        for scene in scenes:
+            place = scene.get("backgrounds")
+            resolved, method = self.backgrounds.resolve(place)
+            self._count(method)
+            if resolved is not None:
+                scene["backgrounds"] = resolved
+            else:
+                unresolved.setdefault(("background", str(place)), {"kind": "background", "name": place,
+                                                                  "text": scene.get("label", "")})
+            for m in scene.get("memes") or []:
+                resolved, method = self.memes.resolve(m.get("name"))
+                self._count(method)
+                if resolved is not None:
+                    m["name"] = resolved
+                else:
+                    unresolved.setdefault(("meme", str(m.get("name"))), {"kind": "meme", "name": m.get("name"),
+                                                                        "text": m.get("text", "")})
+        return list(unresolved.values())
+
+    def apply(self, scenes, mapping, default_meme="其他", default_background="others"):
+        """
+        应用LLM给出的 {原名: 新名} 映射；映射缺失或不在素材库中时使用默认素材
+        """
+        for scene in scenes:
+            place = scene.get("backgrounds")
+            if self.backgrounds.resolve(place)[0] is None:
+                target = self.backgrounds.resolve(mapping.get(str(place)))[0]
+                self._count("llm" if target else "default")
+                scene["backgrounds"] = target or default_background
+            for m in scene.get("memes") or []:
+                if self.memes.resolve(m.get("name"))[0] is None:
+                    target = self.memes.resolve(mapping.get(str(m.get("name"))))[0]
+                    self._count("llm" if target else "default")
+                    m["name"] = target or default_meme
+        return scenes
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        local = sum(v for k, v in counts.items() if k in ("exact", "variant", "synonym", "ngram"))
+        total = local + counts.get("unresolved", 0)
+        counts["total"] = total
+        counts["escalation_rate"] = round(counts.get("unresolved", 0) / total, 4) if total else 0.0
+        return counts
@@ -1,25 +1,57 @@
 import os
 import json
 import traceback
-from openai import OpenAI
+import threading
 from dotenv import load_dotenv
-from prompt import PromptTemplate, script2json_prompt, json_check
+from prompt import PromptTemplate, script2json_prompt, json_check, name_resolve_prompt
+from llm import chat_completion, stream_chat_completion, client_pool, prompt_cache_params
+from resolver import NameResolver
+from catalog import catalog
 
 load_dotenv()
 MODEL = os.environ.get('MODEL')
-backgrounds = os.listdir('./backgrounds')
-meme_names = os.listdir("./meme")
-backgrounds = [b.split('.')[0] for b in backgrounds]
-meme_names = [m.split('.')[0] for m in meme_names]
+
+# 素材列表以紧凑格式注入提示词（meme按情绪分组），system部分在首次使用时按当前素材目录渲染
+CATALOGS = {"memes": True, "backgrounds": False}
+s2j = PromptTemplate(
+    system_template=(script2json_prompt),
+    user_template=("这是一段**脚本内容**，请按照要求生成json：{script}"),
+    catalogs=CATALOGS
+)
+jc = PromptTemplate(
+    system_template=json_check,
+    user_template="请按照要求重新检查这段json并生成：{jsondata}",
+    catalogs=CATALOGS
+)
+nr = PromptTemplate(
+    system_template=name_resolve_prompt,
+    user_template="{items}",
+    catalogs=CATALOGS
+)
+_prepared = {"version": None, "resolver": None}
+_prepared_lock = threading.Lock()
+
+def prepare_catalog():
+    """
+    按当前素材目录预渲染提示词并构建名字解析器，返回解析器
+    素材目录没有变化时直接复用，增删素材后自动重建
+    """
+    version = catalog.version()
+    with _prepared_lock:
+        if _prepared["version"] != version:
+            backgrounds, meme_names = catalog.backgrounds, catalog.memes
+            for template in (s2j, jc, nr):
+                template.prerender(backgrounds=backgrounds, memes=meme_names)
+            _prepared["resolver"] = NameResolver(meme_names, backgrounds)
+            _prepared["version"] = version
+        return _prepared["resolver"]
+
 def init_client():
     api_key = os.environ.get('SCRIPT_API_KEY')
     BASE_URL = os.environ.get('BASE_URL')
     if not api_key:
         raise ValueError("SCRIPT_API_KEY 未设置，请检查.env文件")
-    return OpenAI(
-        api_key=api_key,
-        base_url=BASE_URL,
-    )
+    return client_pool.get(api_key, BASE_URL)
 
 def read_input_file(file_path='text.txt'):
     """读取输入文本文件"""
@@ -57,32 +89,70 @@ def save_to_jsonl(data, output_file="script.jsonl"):
     except Exception as e:
         print(f"保存JSONL文件时出错: {e}")
 
+def resolve_names(scenes, client=None):
+    """
+    把scene中的 backgrounds 和 memes[].name 修正为现有素材
+    先在本地解析（精确匹配、数字变体、同义词表、字符n-gram），只把解析不了的名字交给LLM
+    """
+    resolver = prepare_catalog()
+    unresolved = resolver.resolve_scenes(scenes)
+    mapping = {}
+    if unresolved:
+        print(f"本地无法解析 {len(unresolved)} 个名字，交给LLM: {[u['name'] for u in unresolved]}")
+        try:
+            items = "\n".join(json.dumps(u, ensure_ascii=False) for u in unresolved)
+            res = chat_completion(client or init_client(), model=MODEL, messages=nr.format_messages(items=items))
+            mapping = json.loads(res[res.index("{"):res.rindex("}") + 1])
+        except Exception as e:
+            print(f"LLM名字解析失败，使用默认素材：{e}")
+    resolver.apply(scenes, mapping)
+    return scenes
+
+def read_scenes(json_file):
+    """读取JSONL（或整段JSON数组）格式的脚本，无法解析时返回None"""
+    with open(json_file, 'r', encoding='utf-8') as f:
+        content = f.read().strip()
+    try:
+        data = json.loads(content)
+        scenes = data if isinstance(data, list) else [data]
+    except json.JSONDecodeError:
+        try:
+            scenes = [json.loads(line) for line in content.splitlines() if line.strip()]
+        except json.JSONDecodeError:
+            return None
+    if not scenes or not all(isinstance(s, dict) and "backgrounds" in s for s in scenes):
+        return None
+    return scenes
+
 def jsoncheck(json_file="script.jsonl",output_file="script_checked.jsonl"):
     """
     JSON检查函数：检查json中的background以及name字段是否为LLM生成的幻觉，并重新修改为现有的meme中最相似的
+    名字在本地解析，只有本地解析不了的名字才调用LLM；脚本本身无法解析时仍把整段json交给LLM检查
     """
     try:
+        scenes = read_scenes(json_file)
+        if scenes is not None:
+            resolve_names(scenes)
+            print(f"名字解析统计: {prepare_catalog().stats()}")
+            save_to_jsonl(scenes, output_file)
+            return "\n".join(json.dumps(s, ensure_ascii=False) for s in scenes)
         jsoncheck_client = init_client()
-        jc = PromptTemplate(
-            system_template=json_check,
-            user_template="请按照要求重新检查这段json并生成：{jsondata}"
-        )
+        prepare_catalog()
         with open(json_file, 'r', encoding='utf-8') as f:
             json_str = f.read()
-            jc_prompt = jc.format_messages(jsondata=json_str,backgrounds=backgrounds, memes=meme_names)
+            jc_prompt = jc.format_messages(jsondata=json_str)
             print(json.dumps(jc_prompt,indent=4,ensure_ascii=False))
-            response = jsoncheck_client.chat.completions.create(
-                model=MODEL,
-                messages=jc_prompt,
-                stream=False
-            )
-            res = response.choices[0].message.content
+            res = chat_completion(jsoncheck_client, model=MODEL, messages=jc_prompt)
             save_to_jsonl(res, output_file)
         return res
     except Exception as e:
         print(f"jsoncheck出现问题：{e}")
         return None
 
+def script_messages(input_text):
+    prepare_catalog()
+    return s2j.format_messages(script=input_text)
+
 def get_script(input_file='text.txt', output_file="script.jsonl"):
     """主函数：读取输入文件，生成脚本并保存为JSONL"""
     try:
@@ -90,21 +160,12 @@ def get_script(input_file='text.txt', output_file="script.jsonl"):
         input_text = read_input_file(input_file)
         print(f"成功读取输入文件: {input_file}")
         print(f"输入内容: {input_text[:100]}...")  # 只显示前100个字符
-        s2j = PromptTemplate(
-            system_template=(script2json_prompt),
-            user_template=("这是一段**脚本内容**，请按照要求生成json：{script}")
-        )
-        s2j_prompt = s2j.format_messages(script=input_text,backgrounds=backgrounds, memes=meme_names)
+        s2j_prompt = script_messages(input_text)
         print(s2j_prompt)
         # 初始化客户端并调用API
         client = init_client()
         # full_prompt = fixed_prompt + input_text
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=s2j_prompt,
-            stream=False
-        )
-        res = response.choices[0].message.content
+        res = chat_completion(client, model=MODEL, messages=s2j_prompt, **prompt_cache_params(s2j))
         
         # 打印结果到控制台
         print("\n生成的脚本内容:")
@@ -120,6 +181,81 @@ def get_script(input_file='text.txt', output_file="script.jsonl"):
         print(f"处理过程中出错: {e}")
         return None
 
+class SceneStreamParser:
+    """
+    增量解析LLM输出中的scene对象
+    不要求整段输出是合法JSON：只跟踪最外层 {...} 的括号深度（忽略字符串内的括号），
+    每闭合一个最外层对象就解析出一个scene，因此无论模型按一行一个对象输出，
+    还是输出带缩进的数组、外面包着```json，都能在对象结束时立即得到该scene
+    """
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.current = []
+        self.errors = 0
+
+    def feed(self, text):
+        """输入一段新文本，返回其中完成的scene列表"""
+        scenes = []
+        for ch in text:
+            if self.depth > 0:
+                self.current.append(ch)
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = self.depth > 0
+            elif ch == "{":
+                if self.depth == 0:
+                    self.current = [ch]
+                self.depth += 1
+            elif ch == "}" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    scene = self._parse("".join(self.current))
+                    if scene is not None:
+                        scenes.append(scene)
+        return scenes
+
+    def _parse(self, text):
+        try:
+            scene = json.loads(text)
+        except json.JSONDecodeError as e:
+            self.errors += 1
+            print(f"JSON解析错误: {e}，跳过该scene: {text[:100]}")
+            return None
+        return scene if isinstance(scene, dict) else None
+
+def get_script_stream(input_file='text.txt', output_file="script.jsonl"):
+    """
+    流式生成脚本：边接收模型输出边解析，每完成一个scene立即产出（生成器）
+    同时逐行写入 output_file，结束后与 get_script 的输出格式相同
+    命中LLM缓存时同样经过解析器逐个产出；每个scene产出前先经过 resolve_names 修正素材名
+    """
+    input_text = read_input_file(input_file)
+    print(f"成功读取输入文件: {input_file}")
+    print(f"输入内容: {input_text[:100]}...")
+    client = init_client()
+    parser = SceneStreamParser()
+    count = 0
+    with open(output_file, 'w', encoding='utf-8') as f:
+        for chunk in stream_chat_completion(client, model=MODEL, messages=script_messages(input_text),
+                                            **prompt_cache_params(s2j)):
+            for scene in parser.feed(chunk):
+                resolve_names([scene], client)
+                f.write(json.dumps(scene, ensure_ascii=False) + '\n')
+                f.flush()
+                count += 1
+                print(f"收到场景 {scene.get('scene_number', count)}")
+                yield scene
+    print(f"共生成 {count} 个场景，输出已保存到文件: {output_file}")
+    print(f"名字解析统计: {prepare_catalog().stats()}")
+
 if __name__ == "__main__":
     # get_script()
     jsoncheck()
\ No newline at end of file
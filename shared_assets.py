@@ -0,0 +1,134 @@
+"""
+多进程渲染时共享的素材（背景图片、meme帧）
+主进程把本次要用到的素材解码一次，写入 multiprocessing.shared_memory；
+工作进程启动时按注册表中的名字映射同一块内存，零复制读取，内存占用不随进程数增加
+"""
+import os
+import threading
+import numpy as np
+from multiprocessing import shared_memory
+from assets import meme_cache, background_cache, atlas_entry, atlas_asset
+
+# 设置为0时工作进程各自解码素材
+ENABLED = os.environ.get('SHARED_ASSETS', '1') != '0'
+
+
+def _background_key(path, width, fast):
+    return (os.path.abspath(path), int(width), bool(fast))
+
+
+def _meme_key(name, scale, fps, fast):
+    return (name, round(float(scale), 6), int(fps), bool(fast))
+
+
+class SharedAssetStore:
+    """
+    主进程持有的共享内存块
+    registry() 返回可以传给工作进程的注册表（只包含块名、形状等元数据），渲染结束后 close() 释放
+    """
+    def __init__(self):
+        self._blocks = []
+        self._registry = {"backgrounds": {}, "memes": {}}
+        self._lock = threading.Lock()
+        self.nbytes = 0
+
+    def _put_array(self, array):
+        array = np.ascontiguousarray(array)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+        with self._lock:
+            self._blocks.append(shm)
+            self.nbytes += array.nbytes
+        return {"name": shm.name, "shape": list(array.shape), "dtype": array.dtype.str}
+
+    def put_background(self, path, width, fast, array):
+        block = self._put_array(array)
+        with self._lock:
+            self._registry["backgrounds"][_background_key(path, width, fast)] = block
+
+    def put_meme(self, name, scale, fps, fast, seconds, rgb, alpha, entry):
+        """rgb, alpha, entry 为 assets.atlas_entry 的返回值，可用于时长不超过seconds的场景"""
+        item = dict(entry, rgb=self._put_array(rgb), alpha=self._put_array(alpha), seconds=seconds)
+        with self._lock:
+            self._registry["memes"][_meme_key(name, scale, fps, fast)] = item
+
+    def publish_background(self, path, width, fast=False):
+        """
+        解码背景（经过进程内的背景缓存）并发布，成功时返回True
+        出错时只打印警告：工作进程在渲染该场景时自行解码，错误由该场景报告
+        """
+        try:
+            self.put_background(path, width, fast, background_cache.get(path, width, fast))
+            return True
+        except Exception as e:
+            print(f"警告: 发布共享背景 {os.path.basename(path)} 失败，渲染时单独解码: {e}")
+            return False
+
+    def publish_meme(self, name, scale, fps, fast, seconds):
+        """解码meme前seconds秒的帧并发布；帧图集中已有时跳过。出错时的处理同 publish_background"""
+        if meme_cache.in_atlas(name, scale, seconds, fps):
+            return False
+        try:
+            self.put_meme(name, scale, fps, fast, seconds, *atlas_entry(name, scale, fps, seconds, fast))
+            return True
+        except Exception as e:
+            print(f"警告: 发布共享meme {name} 失败，渲染时单独解码: {e}")
+            return False
+
+    def registry(self):
+        with self._lock:
+            return {kind: dict(items) for kind, items in self._registry.items()}
+
+    def close(self):
+        with self._lock:
+            blocks, self._blocks = self._blocks, []
+        for shm in blocks:
+            shm.close()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class SharedAssets:
+    """工作进程一侧：按注册表映射共享内存块，返回只读视图"""
+    def __init__(self, registry):
+        self.registry = registry
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def _array(self, block):
+        with self._lock:
+            shm = self._blocks.get(block["name"])
+            if shm is None:
+                shm = self._blocks[block["name"]] = shared_memory.SharedMemory(name=block["name"])
+        array = np.ndarray(block["shape"], np.dtype(block["dtype"]), buffer=shm.buf)
+        array.setflags(write=False)
+        return array
+
+    def background(self, path, width, fast=False):
+        block = self.registry["backgrounds"].get(_background_key(path, width, fast))
+        return self._array(block) if block else None
+
+    def meme(self, name, scale, duration, fps=24, fast=False):
+        item = self.registry["memes"].get(_meme_key(name, scale, fps, fast))
+        if item is None or duration > item["seconds"]:
+            return None
+        return atlas_asset(name, scale, fps, duration, self._array(item["rgb"]), self._array(item["alpha"]), item)
+
+
+_attached = None
+
+
+def attach(registry):
+    """工作进程的初始化函数：映射主进程发布的素材，meme_cache 优先从中取出meme帧"""
+    global _attached
+    _attached = SharedAssets(registry)
+    meme_cache.shared = _attached
+
+
+def shared_background(path, width, fast=False):
+    """已发布的背景图片（只读），当前进程没有映射共享素材或没有该背景时返回None"""
+    if _attached is None:
+        return None
+    return _attached.background(path, width, fast)
@@ -0,0 +1,40 @@
+"""编码配置与环境变量覆盖"""
+from encoder import PROFILES, encoder_profile
+
+ENV = ["RENDER_PROFILE", "RENDER_SCALE", "RENDER_FPS", "ENCODER_PRESET", "ENCODER_CRF", "ENCODER_THREADS"]
+
+
+def clear_env(monkeypatch):
+    for env in ENV:
+        monkeypatch.delenv(env, raising=False)
+    for name in PROFILES:
+        for suffix in ("SCALE", "FPS", "PRESET", "CRF", "THREADS"):
+            monkeypatch.delenv(f"RENDER_{name.upper()}_{suffix}", raising=False)
+
+
+def test_unprefixed_overrides_only_apply_to_selected_profile(monkeypatch):
+    clear_env(monkeypatch)
+    monkeypatch.setenv("RENDER_PROFILE", "draft")
+    monkeypatch.setenv("RENDER_SCALE", "0.25")
+    monkeypatch.setenv("ENCODER_CRF", "35")
+    draft = encoder_profile()
+    assert (draft["name"], draft["scale"], draft["crf"]) == ("draft", 0.25, 35)
+    final = encoder_profile("final")
+    assert {k: final[k] for k in PROFILES["final"]} == PROFILES["final"]
+
+
+def test_per_profile_overrides(monkeypatch):
+    clear_env(monkeypatch)
+    monkeypatch.setenv("RENDER_DRAFT_FPS", "8")
+    monkeypatch.setenv("RENDER_FINAL_PRESET", "slow")
+    monkeypatch.setenv("RENDER_FPS", "30")
+    assert encoder_profile("draft")["fps"] == 8
+    final = encoder_profile("final")
+    assert (final["preset"], final["fps"]) == ("slow", 30)
+
+
+def test_arguments_override_environment(monkeypatch):
+    clear_env(monkeypatch)
+    monkeypatch.setenv("RENDER_DRAFT_SCALE", "0.5")
+    assert encoder_profile("draft", scale=0.2, crf=None)["scale"] == 0.2
+    assert encoder_profile("draft")["scale"] == 0.5
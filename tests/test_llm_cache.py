@@ -0,0 +1,144 @@
+"""LLM响应缓存：用本地桩代替OpenAI接口"""
+import os
+import time
+import threading
+from types import SimpleNamespace
+from llm import LLMResponseCache, MemoryStore, DiskStore, chat_completion, stream_chat_completion, no_cache
+
+MESSAGES = [{"role": "system", "content": "你是编剧"}, {"role": "user", "content": "写一个故事"}]
+
+
+class StubClient:
+    """提供 chat.completions.create 的本地桩，记录调用次数，可以让调用阻塞到 release 被设置"""
+    def __init__(self, reply="回复", block=False):
+        self.reply = reply
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not block:
+            self.release.set()
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, stream=False, **params):
+        with self._lock:
+            self.calls += 1
+            n = self.calls
+        self.started.set()
+        self.release.wait(5)
+        content = f"{self.reply}{n}"
+        if stream:
+            return iter([SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=c))], usage=None)
+                         for c in content])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+def memory_cache():
+    return LLMResponseCache(stores=[MemoryStore()], enabled=True)
+
+
+def test_cache_miss_then_hit():
+    client = StubClient()
+    cache = memory_cache()
+    first = chat_completion(client, "m", MESSAGES, cache=cache)
+    second = chat_completion(client, "m", MESSAGES, cache=cache)
+    assert first == second == "回复1"
+    assert client.calls == 1
+    assert cache.stats() == {"hits": 1, "misses": 1, "deduplicated": 0}
+
+
+def test_key_depends_on_model_messages_and_params():
+    client = StubClient()
+    cache = memory_cache()
+    chat_completion(client, "m", MESSAGES, cache=cache)
+    chat_completion(client, "other", MESSAGES, cache=cache)
+    chat_completion(client, "m", MESSAGES[:1], cache=cache)
+    chat_completion(client, "m", MESSAGES, cache=cache, temperature=0.5)
+    assert client.calls == 4
+
+
+def test_concurrent_identical_requests_share_one_call():
+    client = StubClient(block=True)
+    cache = memory_cache()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(chat_completion(client, "m", MESSAGES, cache=cache)))
+               for _ in range(5)]
+    threads[0].start()
+    assert client.started.wait(5)
+    for t in threads[1:]:
+        t.start()
+    # 等其余请求都进入等待后再放行
+    deadline = time.time() + 5
+    while cache.stats()["deduplicated"] < 4 and time.time() < deadline:
+        time.sleep(0.01)
+    client.release.set()
+    for t in threads:
+        t.join(5)
+    assert results == ["回复1"] * 5
+    assert client.calls == 1
+    assert cache.stats()["deduplicated"] == 4
+
+
+def test_error_is_shared_and_not_cached():
+    cache = memory_cache()
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise RuntimeError("接口错误")
+
+    for _ in range(2):
+        try:
+            cache.get_or_call("k", fail)
+        except RuntimeError:
+            pass
+    assert len(calls) == 2
+    assert cache.lookup("k") is None
+
+
+def test_disk_store_survives_new_cache_instance(tmp_path):
+    client = StubClient()
+    first = LLMResponseCache(stores=[MemoryStore(), DiskStore(str(tmp_path))], enabled=True)
+    chat_completion(client, "m", MESSAGES, cache=first)
+    second = LLMResponseCache(stores=[MemoryStore(), DiskStore(str(tmp_path))], enabled=True)
+    assert chat_completion(client, "m", MESSAGES, cache=second) == "回复1"
+    assert client.calls == 1
+    # 磁盘命中回填到内存
+    assert second.stores[0].get(LLMResponseCache.key("m", MESSAGES)) == "回复1"
+
+
+def test_disk_store_expires_entries(tmp_path):
+    store = DiskStore(str(tmp_path), ttl=60)
+    store.put("ab" * 32, "旧回复")
+    path = store._path("ab" * 32)
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    assert store.get("ab" * 32) is None
+    assert not os.path.exists(path)
+
+
+def test_disk_store_evicts_least_recently_used(tmp_path):
+    store = DiskStore(str(tmp_path), max_bytes=200, ttl=0)
+    keys = [f"{i:02d}" * 32 for i in range(5)]
+    for i, key in enumerate(keys):
+        store.put(key, "x" * 60)
+        t = time.time() - 100 + i
+        os.utime(store._path(key), (t, t))
+    store.evict()
+    remaining = [key for key in keys if os.path.exists(store._path(key))]
+    assert remaining == keys[-2:]
+
+
+def test_stream_shares_cache_with_non_stream():
+    client = StubClient()
+    cache = memory_cache()
+    streamed = "".join(stream_chat_completion(client, "m", MESSAGES, cache=cache))
+    assert streamed == "回复1"
+    assert chat_completion(client, "m", MESSAGES, cache=cache) == "回复1"
+    assert client.calls == 1
+
+
+def test_no_cache_always_calls():
+    client = StubClient()
+    assert chat_completion(client, "m", MESSAGES, cache=no_cache) == "回复1"
+    assert chat_completion(client, "m", MESSAGES, cache=no_cache) == "回复2"
@@ -0,0 +1,131 @@
+"""共享LLM客户端：用本地模拟HTTP服务验证连接复用、超时和重试"""
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from llm import ClientPool, chat_completion, LLMResponseCache, MemoryStore
+
+openai = pytest.importorskip("openai")
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 才能保持长连接
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.requests += 1
+            n = self.server.requests
+            action = self.server.script.pop(0) if self.server.script else "ok"
+        if action == "slow":
+            time.sleep(1)
+        if action == "error":
+            data = json.dumps({"error": {"message": "服务暂时不可用"}}).encode()
+            self.send_response(500)
+        else:
+            data = json.dumps({
+                "id": f"mock-{n}", "object": "chat.completion", "created": 0, "model": body["model"],
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": f"回复{n}"}}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12},
+            }).encode()
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    httpd.lock = threading.Lock()
+    httpd.connections = 0
+    httpd.requests = 0
+    httpd.script = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.base_url = f"http://127.0.0.1:{httpd.server_address[1]}/v1"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def ask(client, text="你好"):
+    cache = LLMResponseCache(stores=[MemoryStore()], enabled=False)
+    return chat_completion(client, "mock-model", [{"role": "user", "content": text}], cache=cache)
+
+
+def test_one_client_per_endpoint_and_key(server):
+    pool = ClientPool(timeout=5, connect_timeout=5, max_retries=0)
+    a = pool.get("key", server.base_url)
+    assert pool.get("key", server.base_url) is a
+    assert pool.get("other", server.base_url) is not a
+    assert pool.get("key", server.base_url + "/") is not a
+    pool.close()
+
+
+def test_requests_reuse_one_connection(server):
+    pool = ClientPool(timeout=5, connect_timeout=5, max_retries=0)
+    client = pool.get("key", server.base_url)
+    replies = [ask(client, f"问题{i}") for i in range(5)]
+    assert replies == [f"回复{i}" for i in range(1, 6)]
+    assert server.requests == 5
+    assert server.connections == 1
+    pool.close()
+
+
+def test_retries_server_errors(server):
+    server.script = ["error", "error"]
+    pool = ClientPool(timeout=5, connect_timeout=5, max_retries=2)
+    assert ask(pool.get("key", server.base_url)) == "回复3"
+    assert server.requests == 3
+    pool.close()
+
+
+def test_gives_up_after_max_retries(server):
+    server.script = ["error", "error"]
+    pool = ClientPool(timeout=5, connect_timeout=5, max_retries=1)
+    with pytest.raises(openai.InternalServerError):
+        ask(pool.get("key", server.base_url))
+    assert server.requests == 2
+    pool.close()
+
+
+def test_request_timeout(server):
+    server.script = ["slow"]
+    pool = ClientPool(timeout=0.2, connect_timeout=5, max_retries=0)
+    with pytest.raises(openai.APITimeoutError):
+        ask(pool.get("key", server.base_url))
+    pool.close()
+
+
+def test_settings_from_dotenv_apply_before_import(tmp_path):
+    """creativity 在调用 load_dotenv() 之前导入 llm，.env 中的 LLM_* 配置仍应生效"""
+    env_file = tmp_path / ".env"
+    env_file.write_text("LLM_TIMEOUT=7\nLLM_MAX_RETRIES=5\n", encoding="utf-8")
+    code = (
+        "import dotenv\n"
+        "original = dotenv.load_dotenv\n"
+        f"dotenv.load_dotenv = lambda *a, **k: original({str(env_file)!r})\n"
+        "import creativity, llm\n"
+        "print(llm.client_pool.timeout, llm.client_pool.max_retries)\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {k: v for k, v in os.environ.items() if not k.startswith("LLM_")}
+    result = subprocess.run([sys.executable, "-c", code], cwd=root, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split()[-2:] == ["7.0", "5"]
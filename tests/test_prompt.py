@@ -0,0 +1,58 @@
+"""预编译提示词模板"""
+import pytest
+import prompt
+from prompt import CompiledTemplate, PromptTemplate, render_catalog
+
+PROMPTS = ["query2script_prompt", "script2json_prompt", "json_check", "name_resolve_prompt"]
+VALUES = {"memes": "开心,愤怒,吃饭2", "backgrounds": "home,school"}
+
+
+@pytest.mark.parametrize("name", PROMPTS)
+def test_compiled_matches_str_format(name):
+    template = getattr(prompt, name)
+    compiled = CompiledTemplate(template)
+    kwargs = {k: VALUES[k] for k in compiled.fields}
+    assert compiled.render(**kwargs) == template.format(**kwargs)
+
+
+@pytest.mark.parametrize("template", [
+    "", "纯文本", "{a}", "{{转义}}{a}{{b}}", "前{a!r}中{b:>5}后", "{a[0]}{a[1]}", "{{{a}}}",
+])
+def test_compiled_matches_str_format_edge_cases(template):
+    kwargs = {"a": ["x", "y"] if "[" in template else "值", "b": "右"}
+    compiled = CompiledTemplate(template)
+    assert compiled.render(**kwargs) == template.format(**kwargs)
+
+
+def test_prerendered_system_matches_format():
+    t = PromptTemplate(system_template=prompt.script2json_prompt, user_template="脚本：{script}",
+                       catalogs={"memes": True, "backgrounds": False})
+    memes, backgrounds = ["开心", "愤怒", "吃饭", "吃饭2"], ["home", "school"]
+    t.prerender(memes=memes, backgrounds=backgrounds)
+    messages = t.format_messages(script="内容")
+    expected = prompt.script2json_prompt.format(memes=render_catalog(memes, True),
+                                                backgrounds=render_catalog(backgrounds, False))
+    assert messages == [{"role": "system", "content": expected}, {"role": "user", "content": "脚本：内容"}]
+
+
+def test_system_cache_reuses_and_varies_with_values():
+    t = PromptTemplate(system_template="素材：{memes}")
+    first = t.render_system(memes="a")
+    assert t.render_system(memes="a") is first
+    assert t.render_system(memes="b") == "素材：b"
+
+
+def test_set_system_template_invalidates_prerender_cache():
+    t = PromptTemplate(system_template="旧：{memes}", user_template="{q}").prerender(memes="a")
+    assert t.format_messages(q="问")[0]["content"] == "旧：a"
+    old_hash = t.prefix_hash()
+    t.set_system_template("新：{memes}")
+    assert t.format_messages(q="问")[0]["content"] == "新：a"
+    assert t.prefix_hash() != old_hash
+
+
+def test_set_user_template_recompiles():
+    t = PromptTemplate(user_template="旧{q}")
+    assert t.format_messages(q="1")[0]["content"] == "旧1"
+    t.set_user_template("新{q}")
+    assert t.format_messages(q="1")[0]["content"] == "新1"
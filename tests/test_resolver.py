@@ -0,0 +1,56 @@
+"""本地素材名解析"""
+import pytest
+from resolver import NameIndex, NameResolver
+
+MEMES = ["开心", "高兴", "不想听", "不想听2", "不认真", "认真工作", "吃饭", "吃饭2", "愤怒", "忧郁", "烦躁", "其他"]
+BACKGROUNDS = ["home", "school", "others"]
+
+
+@pytest.fixture
+def index():
+    return NameIndex(MEMES, {"生气": "愤怒", "不开心": "忧郁"})
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("开心", ("开心", "exact")),
+    ("吃饭3", ("吃饭", "variant")),
+    ("生气", ("愤怒", "synonym")),
+    ("开心一点", ("开心", "ngram")),
+    ("不想听了", ("不想听", "ngram")),
+    ("不认真了", ("不认真", "ngram")),
+    ("没认真", ("不认真", "ngram")),
+    ("认真", ("认真工作", "ngram")),
+])
+def test_resolves_locally(index, name, expected):
+    assert index.resolve(name) == expected
+
+
+@pytest.mark.parametrize("name", ["不高兴", "没开心", "不想吃", "不吃饭", "没工作"])
+def test_negation_does_not_match_opposite(index, name):
+    """否定前缀不同或去掉前缀后不相近的名字不做模糊匹配，交给LLM"""
+    assert index.resolve(name) == (None, "unresolved")
+
+
+def test_synonym_for_negated_name_still_applies(index):
+    assert index.resolve("不开心") == ("忧郁", "synonym")
+
+
+def test_negated_names_in_default_synonyms():
+    resolver = NameResolver(MEMES, BACKGROUNDS)
+    assert resolver.memes.resolve("不开心")[0] == "忧郁"
+    assert resolver.memes.resolve("不高兴")[0] == "烦躁"
+
+
+def test_resolver_escalates_only_unresolved():
+    resolver = NameResolver(MEMES, BACKGROUNDS)
+    scenes = [{"backgrounds": "campus", "memes": [{"name": "开心"}, {"name": "不想吃", "text": "我不吃"}]},
+              {"backgrounds": "moon", "memes": [{"name": "不想吃"}]}]
+    unresolved = resolver.resolve_scenes(scenes)
+    assert scenes[0]["backgrounds"] == "school"
+    assert {(u["kind"], u["name"]) for u in unresolved} == {("meme", "不想吃"), ("background", "moon")}
+    resolver.apply(scenes, {"不想吃": "不想听2", "moon": "火星"})
+    assert scenes[0]["memes"][1]["name"] == "不想听2"
+    assert scenes[1]["backgrounds"] == "others"
+    stats = resolver.stats()
+    assert stats["unresolved"] == 3 and stats["total"] == 5
+    assert stats["llm"] == 2 and stats["default"] == 1
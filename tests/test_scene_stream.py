@@ -0,0 +1,53 @@
+"""流式脚本中scene对象的增量解析"""
+import json
+from script import SceneStreamParser
+
+SCENES = [
+    {"scene_number": 1, "backgrounds": "school", "label": "开学", "memes": [{"name": "开心", "text": "你好{世界}"}]},
+    {"scene_number": 2, "backgrounds": "home", "label": "他说\"回家\"", "memes": []},
+    {"scene_number": 3, "backgrounds": "home", "label": "反斜杠\\和}括号{", "memes": [{"name": "愤怒"}]},
+]
+
+
+def feed_chunks(text, size):
+    parser = SceneStreamParser()
+    scenes = []
+    for i in range(0, len(text), size):
+        scenes += parser.feed(text[i:i + size])
+    return scenes, parser
+
+
+def test_one_object_per_line():
+    text = "\n".join(json.dumps(s, ensure_ascii=False) for s in SCENES)
+    for size in (1, 7, len(text)):
+        assert feed_chunks(text, size)[0] == SCENES
+
+
+def test_indented_array():
+    text = json.dumps(SCENES, ensure_ascii=False, indent=2)
+    for size in (1, 13):
+        assert feed_chunks(text, size)[0] == SCENES
+
+
+def test_code_fenced_output_with_commentary():
+    text = "好的，下面是脚本：\n```json\n" + json.dumps(SCENES, ensure_ascii=False) + "\n```\n以上。"
+    assert feed_chunks(text, 5)[0] == SCENES
+
+
+def test_scene_is_returned_as_soon_as_it_closes():
+    parser = SceneStreamParser()
+    first = json.dumps(SCENES[0], ensure_ascii=False)
+    assert parser.feed(first[:-1]) == []
+    assert parser.feed(first[-1] + "\n{") == [SCENES[0]]
+
+
+def test_malformed_object_is_skipped():
+    text = '{"scene_number": 1, "label": 缺引号}\n' + json.dumps(SCENES[1], ensure_ascii=False)
+    scenes, parser = feed_chunks(text, 4)
+    assert scenes == [SCENES[1]]
+    assert parser.errors == 1
+
+
+def test_non_object_values_are_ignored():
+    text = '["说明文字", 1, {"scene_number": 1}]'
+    assert feed_chunks(text, 3)[0] == [{"scene_number": 1}]
@@ -1,25 +1,51 @@
 import os
 import tempfile
 from creativity import get_text
-from script import get_script
-from movie import process_jsonl_story
+from script import get_script, get_script_stream
+from movie import process_jsonl_story, process_story_stream
 
-def generate_video_from_input(input_text):
-    """整合的视频生成流程"""
+def generate_video_from_input(input_text, output_dir=None, progress=None, stream=None, profile=None):
+    """
+    整合的视频生成流程
+    output_dir: 脚本、片段和最终视频的输出目录，默认脚本写到当前目录、视频写到 results
+    progress: 可选回调，以 dict 形式报告当前阶段和每个场景的渲染进度
+    stream: 是否流式生成脚本并边生成边渲染，默认读取环境变量 SCRIPT_STREAM（未设置时开启）
+    profile: 渲染配置，"draft" 为低分辨率快速预览，默认读取环境变量 RENDER_PROFILE
+    """
+    if stream is None:
+        stream = os.environ.get('SCRIPT_STREAM', '1') != '0'
+
+    def report(**info):
+        if progress is not None:
+            progress(info)
     
     # 创建临时目录存放中间文件
     with tempfile.TemporaryDirectory() as temp_dir:
         try:
             print("开始视频生成流程...")
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
             
             # 步骤1: 生成创意文本
             print("步骤1: 生成创意文本...")
+            report(stage="creativity")
             text_file = os.path.join(temp_dir, "text.txt")
             creative_text = get_text(input_text, text_file)
             
+            script_file = os.path.join(output_dir or os.getcwd(), "script_checked.jsonl")
+            if stream:
+                # 步骤2+3: 流式生成脚本，每收到一个场景立即开始渲染
+                print("步骤2: 流式生成脚本并渲染视频...")
+                report(stage="script")
+                success = process_story_stream(get_script_stream(text_file, script_file), output_dir=output_dir,
+                                               progress=lambda info: report(stage="render", **info),
+                                               profile=profile)
+                print("视频生成成功！" if success else "视频生成失败")
+                return success
+
             # 步骤2: 生成脚本
             print("步骤2: 生成脚本...")
-            script_file = os.path.join(os.getcwd(), "script_checked.jsonl")
+            report(stage="script")
             script_content = get_script(text_file, script_file)
             
             if not script_content:
@@ -28,7 +54,10 @@ def generate_video_from_input(input_text):
             
             # 步骤3: 生成视频
             print("步骤3: 生成视频...")
-            success = process_jsonl_story(script_file)
+            report(stage="render")
+            success = process_jsonl_story(script_file, output_dir=output_dir,
+                                          progress=lambda info: report(stage="render", **info),
+                                          profile=profile)
             
             if success:
                 print(f"视频生成成功！")
@@ -47,4 +76,4 @@ def generate_video_from_input(input_text):
 if __name__ == "__main__":
     # 测试代码
     test_input = "不想上班"
-    generate_video_from_input(test_input)
\ No newline at end of file
+    generate_video_from_input(test_input)